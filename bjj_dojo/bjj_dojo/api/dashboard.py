@@ -2,18 +2,74 @@
 # For license information, please see license.txt
 
 import frappe
-from frappe.utils import today, add_days, add_months, flt
+from frappe.utils import today, add_days, add_months, date_diff, get_first_day, getdate, flt
+
+from bjj_dojo.bjj_dojo.cache import cached_aggregate, versioned
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import get_members_summary, get_birthday_keys
+
+
+PERIOD_MONTHS = {
+	"1month": 1,
+	"3months": 3,
+	"6months": 6,
+	"1year": 12
+}
+
+
+def get_date_windows(earnings_period="1year", members_period="6months"):
+	"""Get the date boundaries shared by the dashboard widgets"""
+	current_date = today()
+	
+	return frappe._dict({
+		"today": current_date,
+		"week_start": add_days(current_date, -7),
+		"fortnight_start": add_days(current_date, -14),
+		"thirty_days_ago": add_days(current_date, -30),
+		"month_start": get_first_day(current_date),
+		"members_start": add_months(current_date, -PERIOD_MONTHS.get(members_period, 6))
+	})
+
+
+@frappe.whitelist()
+@versioned("get_dashboard_snapshot")
+def get_dashboard_snapshot(earnings_period="1year", members_period="6months", earnings_compare="previous_year"):
+	"""Get every dashboard widget in a single round trip"""
+	windows = get_date_windows(earnings_period, members_period)
+	members_summary = get_members_summary()
+	
+	return {
+		"members": members_summary,
+		"classes_today": frappe.db.count("Dojo Class", {
+			"class_date": windows.today,
+			"status": ["!=", "Cancelled"]
+		}),
+		"check_ins_today": frappe.db.get_value("Dojo Daily Metrics", windows.today, "check_ins") or 0,
+		"promotions_this_month": frappe.db.count("Belt Promotion", {
+			"promotion_date": [">=", windows.month_start],
+			"docstatus": 1
+		}),
+		"earnings": get_earnings_trend(earnings_period, earnings_compare),
+		"member_growth": get_member_growth_trend(members_period),
+		"recommendations": build_recommendations(windows, members_summary),
+		"recent_activity": build_recent_activity(windows)
+	}
 
 
 @frappe.whitelist()
+@versioned("get_recommendations")
 def get_recommendations():
 	"""Get recommended actions for the dashboard"""
+	return build_recommendations(get_date_windows())
+
+
+def build_recommendations(windows, members_summary=None):
+	"""Build recommended actions from precomputed date windows"""
 	recommendations = []
 	
 	# New members who need follow-up (joined in last 7 days)
 	recent_members = frappe.get_all("Dojo Member",
 		filters={
-			"join_date": [">=", add_days(today(), -7)],
+			"join_date": [">=", windows.week_start],
 			"status": "Active"
 		},
 		fields=["name", "member_name", "join_date", "email"],
@@ -29,15 +85,22 @@ def get_recommendations():
 			"priority": "high"
 		})
 	
-	# Members with overdue payments
-	overdue_members = frappe.get_all("Dojo Member",
-		filters={
-			"payment_status": "Overdue",
-			"status": "Active"
-		},
-		fields=["name", "member_name", "outstanding_amount"],
-		limit=5
-	)
+	# Members with overdue payments (skipped when the summary already shows none)
+	overdue_members = []
+	overdue_count = None
+	if members_summary:
+		overdue_count = sum(row.count for row in members_summary["payment_status"]
+			if row.payment_status == "Overdue")
+	
+	if overdue_count is None or overdue_count:
+		overdue_members = frappe.get_all("Dojo Member",
+			filters={
+				"payment_status": "Overdue",
+				"status": "Active"
+			},
+			fields=["name", "member_name", "outstanding_amount"],
+			limit=5
+		)
 	
 	if overdue_members:
 		total_overdue = sum([flt(m.outstanding_amount) for m in overdue_members])
@@ -49,44 +112,36 @@ def get_recommendations():
 			"priority": "medium"
 		})
 	
-	# Members who haven't attended in 30 days
+	# Members who haven't attended in 30 days (range scan on status, last_attendance_date)
 	inactive_members = frappe.db.sql("""
-		SELECT dm.name, dm.member_name, MAX(ca.class_date) as last_attendance
-		FROM `tabDojo Member` dm
-		LEFT JOIN `tabClass Attendance` ca ON dm.name = ca.member AND ca.status = 'Present'
-		WHERE dm.status = 'Active'
-		GROUP BY dm.name, dm.member_name
-		HAVING last_attendance < %s OR last_attendance IS NULL
-		LIMIT 10
-	""", add_days(today(), -30), as_dict=True)
+		SELECT COUNT(*)
+		FROM `tabDojo Member`
+		WHERE status = 'Active'
+			AND (last_attendance_date < %s OR last_attendance_date IS NULL)
+	""", windows.thirty_days_ago)[0][0]
 	
 	if inactive_members:
 		recommendations.append({
 			"title": "Set up automation email to follow up",
-			"description": f"with {len(inactive_members)} past members who haven't attended recently",
+			"description": f"with {inactive_members} past members who haven't attended recently",
 			"action": "setup_email_automation",
 			"icon": "fa-envelope",
 			"priority": "low"
 		})
 	
-	# Members eligible for belt promotion
+	# Members eligible for belt promotion (range scan on status, eligible_from_date)
 	eligible_promotions = frappe.db.sql("""
-		SELECT dm.name, dm.member_name, dm.current_belt,
-			DATEDIFF(CURDATE(), COALESCE(dm.belt_promotion_date, dm.join_date)) / 30 as months_in_belt
-		FROM `tabDojo Member` dm
-		WHERE dm.status = 'Active'
-			AND DATEDIFF(CURDATE(), COALESCE(dm.belt_promotion_date, dm.join_date)) / 30 >= 
-				CASE dm.current_belt
-					WHEN 'White' THEN 12
-					WHEN 'Blue' THEN 24
-					WHEN 'Purple' THEN 24
-					WHEN 'Brown' THEN 12
-					ELSE 36
-				END
+		SELECT name, member_name, current_belt,
+			COALESCE(belt_promotion_date, join_date) as belt_start
+		FROM `tabDojo Member`
+		WHERE status = 'Active'
+			AND eligible_from_date <= %s
+		ORDER BY eligible_from_date
 		LIMIT 5
-	""", as_dict=True)
+	""", windows.today, as_dict=True)
 	
 	for member in eligible_promotions:
+		member.months_in_belt = date_diff(windows.today, member.belt_start) / 30
 		recommendations.append({
 			"title": f"Consider promoting {member.member_name}",
 			"description": f"from {member.current_belt} belt ({member.months_in_belt:.0f} months)",
@@ -99,14 +154,20 @@ def get_recommendations():
 
 
 @frappe.whitelist()
+@versioned("get_recent_activity")
 def get_recent_activity():
 	"""Get recent member activity for the dashboard"""
+	return build_recent_activity(get_date_windows())
+
+
+def build_recent_activity(windows):
+	"""Build the recent activity feed from precomputed date windows"""
 	activities = []
 	
 	# Recent payments
 	recent_payments = frappe.get_all("Dojo Payment",
 		filters={
-			"payment_date": [">=", add_days(today(), -7)],
+			"payment_date": [">=", windows.week_start],
 			"status": "Completed"
 		},
 		fields=["member", "member_name", "amount", "payment_type", "payment_date"],
@@ -128,7 +189,7 @@ def get_recent_activity():
 	cancelled_members = frappe.get_all("Dojo Member",
 		filters={
 			"status": "Inactive",
-			"modified": [">=", add_days(today(), -7)]
+			"modified": [">=", windows.week_start]
 		},
 		fields=["name", "member_name", "next_payment_due", "modified"],
 		order_by="modified desc",
@@ -148,7 +209,7 @@ def get_recent_activity():
 	# Recent belt promotions
 	recent_promotions = frappe.get_all("Belt Promotion",
 		filters={
-			"promotion_date": [">=", add_days(today(), -14)],
+			"promotion_date": [">=", windows.fortnight_start],
 			"docstatus": 1
 		},
 		fields=["member", "member_name", "to_belt", "promotion_date"],
@@ -170,11 +231,13 @@ def get_recent_activity():
 	# This would be expanded when POS integration is added
 	
 	# Sort activities by date and return top 5
-	activities.sort(key=lambda x: x['date'], reverse=True)
+	activities.sort(key=lambda x: str(x['date']), reverse=True)
 	return activities[:5]
 
 
 @frappe.whitelist()
+@versioned("get_dashboard_stats")
+@cached_aggregate("get_dashboard_stats")
 def get_dashboard_stats():
 	"""Get key statistics for dashboard"""
 	stats = {}
@@ -198,11 +261,10 @@ def get_dashboard_stats():
 	
 	# Revenue statistics
 	monthly_revenue = frappe.db.sql("""
-		SELECT IFNULL(SUM(amount), 0) as total
-		FROM `tabDojo Payment`
-		WHERE payment_date >= %s 
-			AND payment_date <= %s
-			AND status = 'Completed'
+		SELECT IFNULL(SUM(total_revenue), 0) as total
+		FROM `tabDojo Daily Metrics`
+		WHERE metric_date >= %s 
+			AND metric_date <= %s
 	""", [add_days(today(), -30), today()])[0][0] or 0
 	
 	stats['monthly_revenue'] = monthly_revenue
@@ -230,76 +292,138 @@ def get_dashboard_stats():
 
 
 @frappe.whitelist()
-def get_earnings_trend(period="1year"):
-	"""Get earnings trend data for charts"""
-	if period == "1month":
-		start_date = add_months(today(), -1)
-		date_format = "%Y-%m-%d"
-		group_by = "DATE(payment_date)"
-	elif period == "3months":
-		start_date = add_months(today(), -3)
-		date_format = "%Y-%m-%d"
-		group_by = "DATE(payment_date)"
-	elif period == "6months":
-		start_date = add_months(today(), -6)
-		date_format = "%Y-%m"
-		group_by = "DATE_FORMAT(payment_date, '%Y-%m')"
-	else:  # 1year
-		start_date = add_months(today(), -12)
-		date_format = "%Y-%m"
-		group_by = "DATE_FORMAT(payment_date, '%Y-%m')"
-	
-	earnings_data = frappe.db.sql(f"""
-		SELECT 
-			{group_by} as period,
-			SUM(amount) as total_amount,
-			COUNT(*) as transaction_count
-		FROM `tabDojo Payment`
-		WHERE payment_date >= %s 
-			AND payment_date <= %s
-			AND status = 'Completed'
-		GROUP BY {group_by}
-		ORDER BY period
-	""", [start_date, today()], as_dict=True)
-	
-	return earnings_data
+@cached_aggregate("get_earnings_trend")
+def get_earnings_trend(period="1year", compare="previous_year"):
+	"""Get zero-filled net revenue per payment type for a period and the one it is compared to"""
+	current_start, current_end, current_buckets, bucket_sql = get_trend_buckets(period)
+	
+	# Compare against the same window a year back, or the window just before it
+	prior_end = add_months(current_end, -12) if compare == "previous_year" else add_days(current_start, -1)
+	prior_start, prior_end, prior_buckets, _ = get_trend_buckets(period, prior_end)
+	
+	windows = {
+		"current": (current_start, current_end, current_buckets),
+		"prior": (prior_start, prior_end, prior_buckets)
+	}
+	
+	# Both windows are bucketed in one statement over the rollup's revenue breakdown
+	rows = frappe.db.sql(" UNION ALL ".join(f"""
+		SELECT '{series}' as series, {bucket_sql} as bucket, r.payment_type, SUM(r.amount) as amount
+		FROM `tabDojo Daily Revenue` r
+		JOIN `tabDojo Daily Metrics` m ON r.parent = m.name AND r.parenttype = 'Dojo Daily Metrics'
+		WHERE m.metric_date BETWEEN %({series}_start)s AND %({series}_end)s
+		GROUP BY bucket, r.payment_type
+	""" for series in windows), {
+		f"{series}_{bound}": value
+		for series, (start_date, end_date, buckets) in windows.items()
+		for bound, value in (("start", start_date), ("end", end_date))
+	}, as_dict=True)
+	
+	type_totals = {}
+	for row in rows:
+		type_totals[row.payment_type] = type_totals.get(row.payment_type, 0) + flt(row.amount)
+	payment_types = sorted(type_totals, key=lambda payment_type: type_totals[payment_type], reverse=True)
+	
+	result = {
+		"granularity": "day" if bucket_sql == "metric_date" else "month",
+		"compare": compare,
+		"payment_types": payment_types
+	}
+	
+	for series, (start_date, end_date, buckets) in windows.items():
+		positions = {bucket: index for index, bucket in enumerate(buckets)}
+		by_type = {payment_type: [0] * len(buckets) for payment_type in payment_types}
+		totals = [0] * len(buckets)
+		
+		for row in rows:
+			if row.series != series:
+				continue
+			index = positions[getdate(row.bucket)]
+			by_type[row.payment_type][index] += flt(row.amount)
+			totals[index] += flt(row.amount)
+		
+		result[series] = {
+			"buckets": buckets,
+			"series": by_type,
+			"total": totals,
+			"total_revenue": sum(totals)
+		}
+	
+	return result
 
 
 @frappe.whitelist()
 def get_member_growth_trend(period="6months"):
-	"""Get member growth trend data"""
-	if period == "1month":
-		start_date = add_months(today(), -1)
-		group_by = "DATE(join_date)"
-	elif period == "3months":
-		start_date = add_months(today(), -3)
-		group_by = "DATE(join_date)"
-	else:  # 6months
-		start_date = add_months(today(), -6)
-		group_by = "DATE_FORMAT(join_date, '%Y-%m')"
-	
-	growth_data = frappe.db.sql(f"""
-		SELECT 
-			{group_by} as period,
-			COUNT(*) as new_members
-		FROM `tabDojo Member`
-		WHERE join_date >= %s 
-			AND join_date <= %s
-		GROUP BY {group_by}
-		ORDER BY period
-	""", [start_date, today()], as_dict=True)
-	
-	# Calculate cumulative member count
-	total_members_before = frappe.db.count("Dojo Member", {
-		"join_date": ["<", start_date]
-	})
-	
-	cumulative_count = total_members_before
-	for data in growth_data:
-		cumulative_count += data.new_members
-		data['total_members'] = cumulative_count
+	"""Get gap-filled joins, cancellations and cumulative member totals per bucket"""
+	start_date, end_date, buckets, bucket_sql = get_trend_buckets(period)
+	
+	# Days before the window collapse into one opening row (NULL sorts first),
+	# so the running sums carry the full history into the first bucket
+	rows = frappe.db.sql(f"""
+		SELECT bucket, joins, cancellations,
+			SUM(joins) OVER (ORDER BY bucket) as total_members,
+			SUM(joins - cancellations) OVER (ORDER BY bucket) as active_members
+		FROM (
+			SELECT
+				CASE WHEN metric_date < %(start_date)s THEN NULL ELSE {bucket_sql} END as bucket,
+				SUM(new_members) as joins,
+				SUM(cancellations) as cancellations
+			FROM `tabDojo Daily Metrics`
+			WHERE metric_date <= %(end_date)s
+			GROUP BY bucket
+		) buckets
+		ORDER BY bucket
+	""", {"start_date": start_date, "end_date": end_date}, as_dict=True)
+	
+	opening = frappe._dict(total_members=0, active_members=0)
+	by_bucket = {}
+	for row in rows:
+		if row.bucket is None:
+			opening = row
+		else:
+			by_bucket[getdate(row.bucket)] = row
+	
+	series = []
+	running = opening
+	for bucket in buckets:
+		row = by_bucket.get(bucket)
+		running = row or running
+		joins = int(row.joins) if row else 0
+		cancellations = int(row.cancellations) if row else 0
+		series.append({
+			"period": bucket,
+			"joins": joins,
+			"cancellations": cancellations,
+			"net_growth": joins - cancellations,
+			"total_members": int(running.total_members or 0),
+			"active_members": int(running.active_members or 0)
+		})
 	
-	return growth_data
+	return {
+		"granularity": "day" if bucket_sql == "metric_date" else "month",
+		"series": series
+	}
+
+
+def get_trend_buckets(period, end_date=None):
+	"""Get the window start and end, bucket dates and rollup bucket expression for a trend period"""
+	end_date = getdate(end_date or today())
+	months = PERIOD_MONTHS.get(period, 6)
+	
+	# Short windows are plotted per day, longer ones per calendar month
+	if months <= 3:
+		start_date = getdate(add_months(end_date, -months))
+		buckets = [getdate(add_days(start_date, offset)) for offset in range(date_diff(end_date, start_date) + 1)]
+		return start_date, end_date, buckets, "metric_date"
+	
+	start_date = getdate(get_first_day(add_months(end_date, -months)))
+	buckets = []
+	bucket = start_date
+	while bucket <= end_date:
+		buckets.append(bucket)
+		bucket = getdate(add_months(bucket, 1))
+	
+	return start_date, end_date, buckets, "DATE_SUB(metric_date, INTERVAL DAYOFMONTH(metric_date) - 1 DAY)"
 
 
 @frappe.whitelist()
@@ -341,10 +465,9 @@ def get_quick_actions():
 		SELECT name, member_name
 		FROM `tabDojo Member`
 		WHERE status = 'Active'
-			AND DAY(date_of_birth) = DAY(CURDATE())
-			AND MONTH(date_of_birth) = MONTH(CURDATE())
+			AND birthday_mmdd IN %(keys)s
 		LIMIT 5
-	""", as_dict=True)
+	""", {"keys": tuple(get_birthday_keys(today()))}, as_dict=True)
 	
 	for member in birthday_members:
 		actions.append({
@@ -355,4 +478,21 @@ def get_quick_actions():
 			"urgency": "low"
 		})
 	
-	return actions
\ No newline at end of file
+	return actions
+
+
+@frappe.whitelist()
+def get_upcoming_birthdays(days=7):
+	"""Get active members with a birthday in the next few days, soonest first"""
+	keys = get_birthday_keys(today(), int(days))
+	
+	members = frappe.db.sql("""
+		SELECT name, member_name, date_of_birth, birthday_mmdd
+		FROM `tabDojo Member`
+		WHERE status = 'Active'
+			AND birthday_mmdd IN %(keys)s
+	""", {"keys": tuple(keys)}, as_dict=True)
+	
+	# Keys are in day order, so their position sorts across month and year ends
+	members.sort(key=lambda member: (keys.index(member.birthday_mmdd), member.member_name))
+	return members
\ No newline at end of file
@@ -0,0 +1,193 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import csv
+import io
+import json
+import tempfile
+
+import frappe
+from frappe.utils import today, getdate, cint
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+
+EXPORT_FORMATS = {
+	"csv": "text/csv",
+	"ndjson": "application/x-ndjson"
+}
+
+# Dataset -> (doctype read, table alias, date field, columns as (label, SQL expression))
+EXPORT_DATASETS = {
+	"members": ("Dojo Member", "m", None, (
+		("member", "m.name"),
+		("member_name", "m.member_name"),
+		("email", "m.email"),
+		("phone", "m.phone"),
+		("status", "m.status"),
+		("membership_type", "m.membership_type"),
+		("join_date", "m.join_date"),
+		("cancellation_date", "m.cancellation_date"),
+		("current_belt", "m.current_belt"),
+		("belt_promotion_date", "m.belt_promotion_date"),
+		("last_attendance_date", "m.last_attendance_date"),
+		("monthly_fee", "m.monthly_fee"),
+		("payment_status", "m.payment_status"),
+		("total_paid", "m.total_paid"),
+		("outstanding_amount", "m.outstanding_amount"),
+		("classes_attended", """(SELECT COUNT(*) FROM `tabClass Attendance` ca
+			WHERE ca.member = m.name AND ca.status = 'Present' {attendance_dates})"""),
+		("payment_count", """(SELECT COUNT(*) FROM `tabDojo Payment` p
+			WHERE p.member = m.name AND p.docstatus = 1 AND p.status IN ('Completed', 'Refunded') {payment_dates})"""),
+		("amount_paid", """(SELECT IFNULL(SUM(p.amount), 0) FROM `tabDojo Payment` p
+			WHERE p.member = m.name AND p.docstatus = 1 AND p.status IN ('Completed', 'Refunded') {payment_dates})""")
+	)),
+	"attendance": ("Class Attendance", "ca", "class_date", (
+		("attendance", "ca.name"),
+		("member", "ca.member"),
+		("member_name", "ca.member_name"),
+		("class", "ca.class"),
+		("class_name", "ca.class_name"),
+		("class_date", "ca.class_date"),
+		("member_type", "ca.member_type"),
+		("status", "ca.status"),
+		("check_in_time", "ca.check_in_time"),
+		("payment_status", "ca.payment_status")
+	)),
+	"payments": ("Dojo Payment", "p", "payment_date", (
+		("payment", "p.name"),
+		("member", "p.member"),
+		("member_name", "p.member_name"),
+		("payment_type", "p.payment_type"),
+		("payment_date", "p.payment_date"),
+		("amount", "p.amount"),
+		("payment_method", "p.payment_method"),
+		("status", "p.status"),
+		("reference_name", "p.reference_name"),
+		("receipt_number", "p.receipt_number"),
+		("transaction_id", "p.transaction_id")
+	))
+}
+
+DATASET_TABLES = {
+	"members": "`tabDojo Member` m",
+	"attendance": "`tabClass Attendance` ca JOIN `tabDojo Member` m ON m.name = ca.member",
+	"payments": "`tabDojo Payment` p LEFT JOIN `tabDojo Member` m ON m.name = p.member"
+}
+
+
+@frappe.whitelist()
+def export_members(dataset="members", format="csv", status=None, belt=None, from_date=None, to_date=None):
+	"""Download members, attendance or payments as CSV or NDJSON"""
+	validate_export(dataset, format)
+	frappe.has_permission(EXPORT_DATASETS[dataset][0], "read", throw=True)
+	frappe.has_permission("Dojo Member", "read", throw=True)
+	
+	# The export is spooled to disk while the database is still connected and then
+	# streamed from the file, so neither step holds the whole export in memory
+	spool = tempfile.TemporaryFile()
+	writer = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+	write_export(writer, dataset, format, status=status, belt=belt, from_date=from_date, to_date=to_date)
+	writer.flush()
+	spool = writer.detach()
+	spool.seek(0)
+	
+	response = Response(wrap_file(frappe.local.request.environ, spool),
+		mimetype=EXPORT_FORMATS[format], direct_passthrough=True)
+	response.headers["Content-Disposition"] = f'attachment; filename="dojo-{dataset}-{today()}.{format}"'
+	return response
+
+
+def validate_export(dataset, format):
+	"""Reject unknown datasets and formats"""
+	if dataset not in EXPORT_DATASETS:
+		frappe.throw(f"Unknown export dataset {dataset}; use one of {', '.join(EXPORT_DATASETS)}")
+	
+	if format not in EXPORT_FORMATS:
+		frappe.throw(f"Unknown export format {format}; use one of {', '.join(EXPORT_FORMATS)}")
+
+
+def write_export(file, dataset, format="csv", chunk_size=5000, **filters):
+	"""Write an export to a text file one row at a time and return the row count"""
+	validate_export(dataset, format)
+	columns = [label for label, expression in EXPORT_DATASETS[dataset][3]]
+	count = 0
+	
+	if format == "csv":
+		writer = csv.writer(file)
+		writer.writerow(columns)
+		for row in iter_export_rows(dataset, chunk_size=chunk_size, **filters):
+			writer.writerow(row)
+			count += 1
+	else:
+		for row in iter_export_rows(dataset, chunk_size=chunk_size, **filters):
+			file.write(json.dumps(dict(zip(columns, row)), default=str))
+			file.write("\n")
+			count += 1
+	
+	return count
+
+
+def iter_export_rows(dataset, status=None, belt=None, from_date=None, to_date=None, chunk_size=5000):
+	"""Yield export rows as tuples, paging on name and streaming each page unbuffered"""
+	query, params = get_export_query(dataset, status, belt, from_date, to_date)
+	params.update({"after": "", "limit": cint(chunk_size)})
+	
+	while True:
+		count = 0
+		
+		# Rows are read off the wire as they are written out; no other query may
+		# run on the connection until the page is exhausted
+		with frappe.db.unbuffered_cursor():
+			for row in frappe.db.sql(query, params, as_iterator=True):
+				count += 1
+				params["after"] = row[0]
+				yield row
+		
+		if count < params["limit"]:
+			break
+
+
+def get_export_query(dataset, status=None, belt=None, from_date=None, to_date=None):
+	"""Build the keyset-paged query for a dataset and its filters"""
+	doctype, alias, date_field, columns = EXPORT_DATASETS[dataset]
+	params = {}
+	conditions = [f"{alias}.name > %(after)s"]
+	
+	if status:
+		conditions.append("m.status = %(status)s")
+		params["status"] = status
+	
+	if belt:
+		conditions.append("m.current_belt = %(belt)s")
+		params["belt"] = belt
+	
+	# The date range filters history rows, and the history totals on the member roster
+	date_filters = {"attendance_dates": "", "payment_dates": ""}
+	if from_date:
+		params["from_date"] = getdate(from_date)
+		date_filters["attendance_dates"] += " AND ca.class_date >= %(from_date)s"
+		date_filters["payment_dates"] += " AND p.payment_date >= %(from_date)s"
+		if date_field:
+			conditions.append(f"{alias}.{date_field} >= %(from_date)s")
+	
+	if to_date:
+		params["to_date"] = getdate(to_date)
+		date_filters["attendance_dates"] += " AND ca.class_date <= %(to_date)s"
+		date_filters["payment_dates"] += " AND p.payment_date <= %(to_date)s"
+		if date_field:
+			conditions.append(f"{alias}.{date_field} <= %(to_date)s")
+	
+	if dataset == "payments":
+		conditions.append("p.docstatus = 1")
+	
+	select = ",\n\t\t\t".join(f"{expression.format(**date_filters)} as `{label}`" for label, expression in columns)
+	query = f"""
+		SELECT {select}
+		FROM {DATASET_TABLES[dataset]}
+		WHERE {" AND ".join(conditions)}
+		ORDER BY {alias}.name
+		LIMIT %(limit)s
+	"""
+	
+	return query, params
\ No newline at end of file
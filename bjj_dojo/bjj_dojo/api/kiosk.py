@@ -0,0 +1,349 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import functools
+from datetime import timedelta
+
+import frappe
+from frappe.utils import cstr, get_datetime, now, now_datetime, today
+
+from bjj_dojo.bjj_dojo.cache import (
+	KIOSK_MEMBER_KEY, KIOSK_CLASSES_KEY, get_class_meta, invalidate_doctype, invalidate_for_bulk_update)
+from bjj_dojo.bjj_dojo.realtime import publish_dashboard_update
+from bjj_dojo.bjj_dojo.doctype.class_attendance.class_attendance import (
+	build_attendance_row, upsert_attendance, upsert_attendance_rows, update_class_attendance_stats)
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import update_daily_metrics
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import refresh_last_attendance_dates, rebuild_attendance_counters
+
+
+# Check-in opens this long before a class starts
+CHECK_IN_OPENS_BEFORE = timedelta(minutes=30)
+
+# Members and classes whose counters still need the kiosk check-ins applied
+PENDING_MEMBERS_KEY = "bjj_dojo:kiosk_pending_members"
+PENDING_CLASSES_KEY = "bjj_dojo:kiosk_pending_classes"
+
+# Largest batch of buffered check-ins a tablet may flush in one request
+MAX_INGEST_EVENTS = 1000
+
+CHECK_IN_EVENT_FIELDS = (
+	"name", "owner", "creation", "modified", "modified_by", "docstatus", "idx",
+	"idempotency_key", "device", "event_time", "batch", "member", "class", "status",
+	"outcome", "attendance", "error"
+)
+
+
+@frappe.whitelist()
+def kiosk_check_in(code, class_name=None):
+	"""Check a member into the class running now from a scanned QR code or typed PIN"""
+	frappe.has_permission("Class Attendance", "create", throw=True)
+	
+	member = get_kiosk_member((code or "").strip())
+	if not member:
+		frappe.throw("Check-in code not recognised", frappe.DoesNotExistError)
+	
+	if member.status != "Active":
+		frappe.throw(f"{member.member_name}'s membership is {member.status.lower()}; please see the front desk")
+	
+	class_meta = get_class_meta(class_name) if class_name else get_current_class()
+	if not class_meta or str(class_meta.class_date) != today():
+		frappe.throw("No class is open for check-in right now")
+	
+	checked_in = write_check_in(class_meta, member)
+	if checked_in:
+		publish_dashboard_update("check_in",
+			class_date=str(class_meta.class_date),
+			delta=1,
+			member=member.name,
+			member_name=member.member_name,
+			class_name=class_meta.class_name
+		)
+		queue_counter_refresh(member.name, class_meta.name)
+	
+	return {
+		"member": member.name,
+		"member_name": member.member_name,
+		"class": class_meta.name,
+		"class_name": class_meta.class_name,
+		"already_checked_in": not checked_in
+	}
+
+
+def get_kiosk_member(code):
+	"""Resolve a PIN or member ID to the member, cached per code"""
+	if not code:
+		return None
+	
+	return frappe.cache.hget(KIOSK_MEMBER_KEY, code, generator=lambda: (frappe.db.sql("""
+		SELECT name, member_name, status
+		FROM `tabDojo Member`
+		WHERE checkin_pin = %(code)s OR name = %(code)s
+		LIMIT 1
+	""", {"code": code}, as_dict=True) or [None])[0])
+
+
+def get_current_class():
+	"""Get the class open for check-in now"""
+	return get_class_at(now_datetime(), include_completed=False)
+
+
+def get_class_at(moment, include_completed=True):
+	"""Get the class open for check-in at a moment, preferring the one that starts closest to it"""
+	class_date = str(moment.date())
+	classes = frappe.cache.hget(KIOSK_CLASSES_KEY, class_date, generator=lambda: frappe.get_all("Dojo Class",
+		filters={"class_date": class_date, "status": ["not in", ["Cancelled", "Postponed"]]},
+		fields=["name", "status", "start_time", "end_time"],
+		order_by="start_time"
+	))
+	
+	time_of_day = timedelta(hours=moment.hour, minutes=moment.minute, seconds=moment.second)
+	open_classes = [
+		row for row in classes
+		if row.start_time is not None and row.end_time is not None
+			and (include_completed or row.status != "Completed")
+			and row.start_time - CHECK_IN_OPENS_BEFORE <= time_of_day <= row.end_time
+	]
+	
+	if not open_classes:
+		return None
+	
+	closest = min(open_classes, key=lambda row: abs(row.start_time - time_of_day))
+	return get_class_meta(closest.name)
+
+
+def write_check_in(class_meta, member):
+	"""Mark the member Present with one upsert; return False if they already were"""
+	# Point read on the unique (class, member) key; repeat scans skip the write entirely
+	existing = frappe.db.get_value("Class Attendance",
+		{"class": class_meta.name, "member": member.name},
+		["name", "member", "status", "class_date", "member_type", "payment_required", "payment_status", "notes"],
+		as_dict=True
+	)
+	if existing and existing.status == "Present":
+		return False
+	
+	row = build_attendance_row(class_meta, {"member": member.name}, {member.name: member.member_name}, existing, now())
+	upsert_attendance_rows([row])
+	return True
+
+
+@frappe.whitelist()
+def ingest_check_ins(events, device=None):
+	"""Apply a batch of check-ins buffered offline by a tablet, once per idempotency key and in event order"""
+	frappe.has_permission("Class Attendance", "create", throw=True)
+	
+	events = frappe.parse_json(events) or []
+	if len(events) > MAX_INGEST_EVENTS:
+		frappe.throw(f"Send at most {MAX_INGEST_EVENTS} check-ins per request")
+	
+	results = []
+	rows = {}
+	timestamp = now()
+	
+	for position, event in enumerate(events):
+		key = cstr(event.get("idempotency_key")).strip()
+		result = {"idempotency_key": key}
+		results.append(result)
+		
+		if not key or len(key) > 140:
+			result.update({"status": "error", "error": "Missing or invalid idempotency key"})
+		elif key in rows:
+			result["status"] = "duplicate"
+		else:
+			rows[key] = build_check_in_event(event, key, device, position, timestamp)
+	
+	claimed = claim_check_in_events(list(rows.values()))
+	apply_check_in_events([row for row in rows.values() if row["name"] in claimed and row["outcome"] == "Pending"])
+	
+	# Keys already ingested by an earlier flush report how that flush applied them
+	earlier = {
+		row.name: row
+		for row in frappe.get_all("Dojo Check-in Event",
+			filters={"name": ["in", [key for key in rows if key not in claimed]]},
+			fields=["name", "outcome", "attendance", "error"]
+		)
+	} if len(claimed) < len(rows) else {}
+	
+	for result in results:
+		key = result["idempotency_key"]
+		if "status" in result:
+			continue
+		
+		if key in claimed:
+			row = rows[key]
+			result.update({"status": row["outcome"].lower(), "attendance_id": row["attendance"], "error": row["error"]})
+		else:
+			row = earlier.get(key) or frappe._dict()
+			result.update({"status": "duplicate", "outcome": row.outcome, "attendance_id": row.attendance})
+	
+	return results
+
+
+def build_check_in_event(event, key, device, position, timestamp):
+	"""Build the Dojo Check-in Event row for one buffered check-in, recording why it cannot apply"""
+	row = {
+		"name": key,
+		"owner": frappe.session.user,
+		"creation": timestamp,
+		"modified": timestamp,
+		"modified_by": frappe.session.user,
+		"docstatus": 0,
+		"idx": position,
+		"idempotency_key": key,
+		"device": device or event.get("device"),
+		"event_time": None,
+		"batch": None,
+		"member": event.get("member"),
+		"class": event.get("class"),
+		"status": event.get("status") or "Present",
+		"outcome": "Pending",
+		"attendance": None,
+		"error": None
+	}
+	
+	try:
+		if not event.get("timestamp"):
+			frappe.throw("Missing timestamp")
+		row["event_time"] = get_datetime(event.get("timestamp"))
+		
+		if not row["member"] and event.get("code"):
+			member = get_kiosk_member(cstr(event.get("code")).strip())
+			row["member"] = member.name if member else None
+		if not row["member"]:
+			frappe.throw("Check-in code not recognised")
+		
+		if not row["class"]:
+			class_meta = get_class_at(row["event_time"])
+			if not class_meta:
+				frappe.throw("No class was open for check-in at the event time")
+			row["class"] = class_meta.name
+	except (frappe.ValidationError, ValueError, TypeError) as e:
+		row.update({"outcome": "Error", "error": str(e)})
+	
+	return row
+
+
+def claim_check_in_events(rows):
+	"""Record the events, returning the keys this request inserted; other keys were ingested before"""
+	if not rows:
+		return set()
+	
+	batch = frappe.generate_hash(length=12)
+	for row in rows:
+		row["batch"] = batch
+	
+	# A concurrent flush of the same key waits on the primary key and then skips it
+	frappe.db.bulk_insert("Dojo Check-in Event",
+		fields=CHECK_IN_EVENT_FIELDS,
+		values=[[row[fieldname] for fieldname in CHECK_IN_EVENT_FIELDS] for row in rows],
+		ignore_duplicates=True
+	)
+	
+	return set(frappe.get_all("Dojo Check-in Event", filters={"batch": batch}, pluck="name"))
+
+
+def apply_check_in_events(rows):
+	"""Apply claimed events to Class Attendance with one batched upsert per class"""
+	# Event order decides which of several marks for the same member and class wins
+	rows = sorted(rows, key=lambda row: (row["event_time"], row["idx"]))
+	latest = {(row["class"], row["member"]): row for row in rows}
+	
+	by_class = {}
+	for row in rows:
+		if latest[(row["class"], row["member"])] is row:
+			by_class.setdefault(row["class"], []).append(row)
+		else:
+			row["outcome"] = "Superseded"
+	
+	# Only unknown members, classes and invalid marks are stored as errors; lock waits and
+	# deadlocks propagate so the request rolls back with its claims and the tablet can retry
+	for class_name, class_rows in by_class.items():
+		try:
+			outcomes = upsert_attendance(class_name,
+				[{"member": row["member"], "status": row["status"]} for row in class_rows])
+		except frappe.ValidationError as e:
+			outcomes = [{"status": "error", "error": str(e)}] * len(class_rows)
+		
+		for row, outcome in zip(class_rows, outcomes):
+			if outcome["status"] == "success":
+				row.update({"outcome": "Applied", "attendance": outcome["attendance_id"]})
+			else:
+				row.update({"outcome": "Error", "error": outcome["error"]})
+	
+	if rows:
+		save_check_in_outcomes(rows)
+
+
+def save_check_in_outcomes(rows):
+	"""Write the outcomes of applied events back with one multi-row statement"""
+	columns = ", ".join(f"`{fieldname}`" for fieldname in CHECK_IN_EVENT_FIELDS)
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * len(CHECK_IN_EVENT_FIELDS)) + ")"] * len(rows))
+	
+	frappe.db.sql(f"""
+		INSERT INTO `tabDojo Check-in Event` ({columns})
+		VALUES {placeholders}
+		ON DUPLICATE KEY UPDATE
+			`outcome` = VALUES(`outcome`),
+			`attendance` = VALUES(`attendance`),
+			`error` = VALUES(`error`)
+	""", [row[fieldname] for row in rows for fieldname in CHECK_IN_EVENT_FIELDS])
+
+
+def queue_counter_refresh(member, class_name):
+	"""Record the check-in for the coalesced counter job once the mark commits"""
+	# Adding the ids and checking for a queued job both wait for the commit, so a
+	# running job either pops the committed mark or a new job is queued for it
+	frappe.db.after_commit.add(functools.partial(add_pending_check_in, member, class_name))
+
+
+def add_pending_check_in(member, class_name):
+	"""Add a committed check-in to the pending sets and make sure a job will apply it"""
+	frappe.cache.sadd(PENDING_MEMBERS_KEY, member)
+	frappe.cache.sadd(PENDING_CLASSES_KEY, class_name)
+	
+	# One queued job absorbs every check-in made before it runs
+	frappe.enqueue("bjj_dojo.bjj_dojo.api.kiosk.apply_kiosk_check_ins",
+		queue="short",
+		job_id="bjj_dojo:kiosk_check_ins",
+		deduplicate=True
+	)
+
+
+def pop_pending(key):
+	"""Take every member of a pending set"""
+	values = [frappe.safe_decode(value) for value in frappe.cache.smembers(key)]
+	if values:
+		frappe.cache.srem(key, *values)
+	
+	return values
+
+
+def apply_kiosk_check_ins():
+	"""Background job: apply queued kiosk check-ins to member, class and daily counters"""
+	# Check-ins that land while the job runs are picked up by the next pass; one added
+	# after the last pass finds this job still running, so the scheduler drains those
+	while True:
+		members = pop_pending(PENDING_MEMBERS_KEY)
+		classes = pop_pending(PENDING_CLASSES_KEY)
+		if not members and not classes:
+			break
+		
+		if members:
+			refresh_last_attendance_dates(members)
+			rebuild_attendance_counters(members)
+		
+		class_dates = set()
+		for class_name in classes:
+			class_meta = get_class_meta(class_name)
+			if class_meta:
+				update_class_attendance_stats(class_meta)
+				class_dates.add(class_meta.class_date)
+		
+		for class_date in class_dates:
+			update_daily_metrics(class_date, ("attendance",))
+		
+		frappe.db.commit()
+		invalidate_doctype("Class Attendance")
+		invalidate_for_bulk_update("Class Attendance")
+		if members:
+			invalidate_for_bulk_update("Dojo Member")
\ No newline at end of file
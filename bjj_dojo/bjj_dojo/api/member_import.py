@@ -0,0 +1,223 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import csv
+import json
+import os
+
+import frappe
+from frappe.utils import now, today, getdate, cint
+
+from bjj_dojo.bjj_dojo.cache import invalidate_for_bulk_update
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import update_daily_metrics
+from bjj_dojo.bjj_dojo.doctype.dojo_member_search_token.dojo_member_search_token import insert_search_tokens
+from bjj_dojo.bjj_dojo.naming import reserve_series_names
+
+
+# Columns an import file may set; everything else on the member is derived
+IMPORT_FIELDS = (
+	"member_name", "email", "phone", "date_of_birth", "status", "membership_type",
+	"join_date", "current_belt", "belt_promotion_date", "instructor",
+	"emergency_contact", "emergency_phone", "medical_conditions", "monthly_fee",
+	"last_payment_date", "notes"
+)
+
+DATE_FIELDS = ("date_of_birth", "join_date", "belt_promotion_date", "last_payment_date")
+
+# Fields set by DojoMember.validate that are written alongside the imported ones
+DERIVED_FIELDS = (
+	"email_key", "birthday_mmdd", "cancellation_date", "eligible_from_date",
+	"payment_status", "next_payment_due", "total_paid", "outstanding_amount"
+)
+
+STANDARD_FIELDS = ("name", "owner", "creation", "modified", "modified_by", "docstatus", "idx", "naming_series")
+
+
+@frappe.whitelist()
+def import_members_file(file_url, dry_run=1):
+	"""Import members from an uploaded CSV or JSONL file"""
+	frappe.has_permission("Dojo Member", "create", throw=True)
+	
+	file_doc = frappe.get_doc("File", {"file_url": file_url})
+	return import_members(file_doc.get_full_path(), dry_run=cint(dry_run))
+
+
+def import_members(file_path, dry_run=False, chunk_size=1000):
+	"""Stream members from a CSV or JSONL file into batched inserts, one transaction per chunk"""
+	report = {"total": 0, "imported": 0, "errors": [], "dry_run": bool(dry_run)}
+	meta = frappe.get_meta("Dojo Member")
+	seen_emails = set()
+	metric_dates = set()
+	chunk = []
+	
+	for row_number, row in read_import_rows(file_path):
+		report["total"] += 1
+		
+		doc, errors = build_member(meta, row)
+		if doc.email_key and doc.email_key in seen_emails:
+			errors.append(f"Email {doc.email} appears earlier in the file")
+		
+		if errors:
+			report["errors"].append({"row": row_number, "member_name": row.get("member_name"), "errors": errors})
+			continue
+		
+		if doc.email_key:
+			seen_emails.add(doc.email_key)
+		
+		chunk.append((row_number, doc))
+		if len(chunk) >= chunk_size:
+			write_member_chunk(chunk, report, metric_dates, dry_run)
+			chunk = []
+	
+	if chunk:
+		write_member_chunk(chunk, report, metric_dates, dry_run)
+	
+	if report["imported"] and not dry_run:
+		invalidate_for_bulk_update("Dojo Member")
+		
+		# Imported members only move the members section of their join and cancellation days
+		for metric_date in sorted(metric_dates):
+			update_daily_metrics(metric_date, ("members",))
+		frappe.db.commit()
+	
+	return report
+
+
+def read_import_rows(file_path):
+	"""Yield (row number, row) from a CSV or JSONL file without loading it whole"""
+	extension = os.path.splitext(file_path)[1].lower()
+	
+	with open(file_path, newline="", encoding="utf-8-sig") as f:
+		if extension == ".csv":
+			# Row 1 is the header
+			for row_number, row in enumerate(csv.DictReader(f), 2):
+				yield row_number, row
+		elif extension in (".jsonl", ".ndjson"):
+			for row_number, line in enumerate(f, 1):
+				if line.strip():
+					try:
+						yield row_number, json.loads(line)
+					except ValueError as e:
+						yield row_number, {"__error__": f"Invalid JSON: {e}"}
+		else:
+			frappe.throw(f"Unsupported import file type {extension}; use .csv or .jsonl")
+
+
+def build_member(meta, row):
+	"""Build an unsaved member from an import row and collect its validation errors"""
+	errors = []
+	if row.get("__error__"):
+		errors.append(row["__error__"])
+	
+	values = {}
+	for fieldname in IMPORT_FIELDS:
+		value = row.get(fieldname)
+		if isinstance(value, str):
+			value = value.strip()
+		if value not in (None, ""):
+			values[fieldname] = value
+	
+	for fieldname in DATE_FIELDS:
+		if fieldname in values:
+			try:
+				values[fieldname] = getdate(values[fieldname])
+			except Exception:
+				errors.append(f"{meta.get_label(fieldname)} {values[fieldname]} is not a valid date")
+				values.pop(fieldname)
+	
+	if "monthly_fee" in values:
+		try:
+			values["monthly_fee"] = float(values["monthly_fee"])
+		except (TypeError, ValueError):
+			errors.append(f"Monthly Fee {values['monthly_fee']} is not a number")
+			values.pop("monthly_fee")
+	
+	doc = frappe.new_doc("Dojo Member")
+	doc.update(values)
+	doc.naming_series = doc.naming_series or meta.get_field("naming_series").options.split("\n")[0]
+	doc.join_date = doc.join_date or getdate(today())
+	
+	for field in meta.fields:
+		if field.reqd and not doc.get(field.fieldname):
+			errors.append(f"{field.label} is required")
+		elif field.fieldtype == "Select" and doc.get(field.fieldname):
+			options = (field.options or "").split("\n")
+			if doc.get(field.fieldname) not in options:
+				errors.append(f"{field.label} must be one of {', '.join(options)}")
+	
+	# validate() has no queries for a new member, so it derives the ledger and dates in memory
+	if not errors:
+		doc.validate()
+	
+	return doc, errors
+
+
+def write_member_chunk(chunk, report, metric_dates, dry_run):
+	"""Write a chunk of validated members with multi-row inserts"""
+	# One query per chunk finds emails already taken by existing members
+	email_keys = [doc.email_key for row_number, doc in chunk if doc.email_key]
+	existing = set(frappe.get_all("Dojo Member",
+		filters={"email_key": ["in", email_keys]},
+		pluck="email_key"
+	)) if email_keys else set()
+	
+	rows = []
+	for row_number, doc in chunk:
+		if doc.email_key in existing:
+			report["errors"].append({
+				"row": row_number,
+				"member_name": doc.member_name,
+				"errors": [f"Email {doc.email} already exists for another member"]
+			})
+		else:
+			rows.append((row_number, doc))
+	
+	members = [doc for row_number, doc in rows]
+	
+	if not members:
+		return
+	
+	if dry_run:
+		report["imported"] += len(members)
+		return
+	
+	names = reserve_series_names(members[0].naming_series, len(members))
+	timestamp = now()
+	fields = STANDARD_FIELDS + IMPORT_FIELDS + DERIVED_FIELDS
+	values = []
+	
+	for doc, name in zip(members, names):
+		doc.update({
+			"name": name,
+			"owner": frappe.session.user,
+			"creation": timestamp,
+			"modified": timestamp,
+			"modified_by": frappe.session.user,
+			"docstatus": 0,
+			"idx": 0
+		})
+		values.append([doc.get(fieldname) for fieldname in fields])
+	
+	try:
+		frappe.db.bulk_insert("Dojo Member", fields=fields, values=values)
+		insert_search_tokens(members)
+		frappe.db.commit()
+	except Exception as e:
+		if not frappe.db.is_unique_key_violation(e):
+			raise
+		
+		# A member saved during the import took one of these emails; report the chunk for a re-run
+		frappe.db.rollback()
+		for row_number, doc in rows:
+			report["errors"].append({
+				"row": row_number,
+				"member_name": doc.member_name,
+				"errors": ["Not imported: another member with one of this chunk's emails was saved during the import"]
+			})
+		return
+	
+	report["imported"] += len(members)
+	metric_dates.update(getdate(doc.get(fieldname))
+		for doc in members
+		for fieldname in ("join_date", "cancellation_date")
+		if doc.get(fieldname))
\ No newline at end of file
@@ -0,0 +1,44 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import cint
+
+from bjj_dojo.bjj_dojo.doctype.dojo_member_search_token.dojo_member_search_token import get_search_terms
+
+
+def escape_like(term):
+	"""Escape LIKE wildcards in a user-supplied prefix"""
+	return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@frappe.whitelist()
+def search_members(query, limit=10):
+	"""Find members by name, email, phone or ID prefix, best matches first"""
+	frappe.has_permission("Dojo Member", "read", throw=True)
+	
+	terms = get_search_terms(query)
+	if not terms or sum(len(term) for term in terms) < 2:
+		return []
+	
+	params = {"limit": min(cint(limit) or 10, 50)}
+	for i, term in enumerate(terms):
+		params[f"prefix_{i}"] = escape_like(term) + "%"
+		params[f"exact_{i}"] = term
+	
+	# Every term has to prefix-match one of the member's tokens; exact token hits rank first
+	any_prefix = " OR ".join(f"t.token LIKE %(prefix_{i})s" for i in range(len(terms)))
+	matched_terms = " + ".join(f"MAX(t.token LIKE %(prefix_{i})s)" for i in range(len(terms)))
+	exact_terms = " + ".join(f"MAX(t.token = %(exact_{i})s)" for i in range(len(terms)))
+	
+	return frappe.db.sql(f"""
+		SELECT m.name, m.member_name, m.email, m.phone, m.status,
+			m.current_belt, m.payment_status, m.profile_image
+		FROM `tabDojo Member Search Token` t
+		JOIN `tabDojo Member` m ON m.name = t.member
+		WHERE {any_prefix}
+		GROUP BY m.name
+		HAVING {matched_terms} = {len(terms)}
+		ORDER BY m.status = 'Active' DESC, {exact_terms} DESC, m.member_name
+		LIMIT %(limit)s
+	""", params, as_dict=True)
\ No newline at end of file
@@ -0,0 +1,262 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import functools
+import hashlib
+import inspect
+import json
+import pickle
+
+import frappe
+from frappe.utils import today
+
+
+# Cached aggregates and the doctypes whose writes make them stale
+CACHE_DEPENDENCIES = {
+	"get_dashboard_stats": ("Dojo Member", "Dojo Class", "Dojo Payment", "Class Attendance", "Belt Promotion"),
+	"get_members_summary": ("Dojo Member",),
+	"get_belt_statistics": ("Dojo Member", "Belt Promotion"),
+	"get_payment_summary": ("Dojo Payment",),
+	"get_earnings_trend": ("Dojo Payment",)
+}
+
+# Datasets served with a version stamp, and the doctypes whose writes bump it
+DATASET_DEPENDENCIES = dict(CACHE_DEPENDENCIES, **{
+	"get_weekly_schedule": ("Dojo Class", "Class Attendance"),
+	"get_recent_activity": ("Dojo Member", "Dojo Payment", "Belt Promotion"),
+	"get_recommendations": ("Dojo Member", "Dojo Payment", "Class Attendance"),
+	"get_dashboard_snapshot": ("Dojo Member", "Dojo Class", "Dojo Payment", "Class Attendance", "Belt Promotion")
+})
+
+CACHE_STATS_KEY = "bjj_dojo:cache_stats"
+VERSIONS_KEY = "bjj_dojo:doctype_versions"
+
+# Member card profiles, one hash field per member, and the doctypes that feed them
+MEMBER_PROFILE_KEY = "bjj_dojo:member_profile"
+MEMBER_PROFILE_DOCTYPES = ("Dojo Member", "Dojo Payment", "Class Attendance", "Belt Promotion")
+
+# Dojo Class fields read by attendance writes, one hash field per class
+CLASS_META_KEY = "bjj_dojo:class_meta"
+CLASS_META_FIELDS = ("name", "class_name", "class_type", "class_date", "status", "max_capacity", "drop_in_fee", "member_fee")
+
+# Door kiosk lookups: check-in code -> member, and date -> that day's classes
+KIOSK_MEMBER_KEY = "bjj_dojo:kiosk_member"
+KIOSK_CLASSES_KEY = "bjj_dojo:kiosk_classes"
+
+
+def get_cache_key(name):
+	"""Get the Redis hash holding every cached variant of an aggregate"""
+	return f"bjj_dojo:aggregate:{name}"
+
+
+def get_args_key(args, kwargs):
+	"""Build a stable hash field for the call arguments"""
+	# Aggregates are relative to today, so the date is part of every key
+	payload = json.dumps([today(), args, sorted(kwargs.items())], default=str)
+	return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def cached_aggregate(name):
+	"""Cache an aggregate endpoint until one of its dependent doctypes changes"""
+	if name not in CACHE_DEPENDENCIES:
+		raise ValueError(f"No cache dependencies declared for {name}")
+	
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			cache_key = get_cache_key(name)
+			args_key = get_args_key(args, kwargs)
+			
+			value = frappe.cache.hget(cache_key, args_key)
+			if value is not None:
+				record_cache_stat(name, "hits")
+				return value
+			
+			record_cache_stat(name, "misses")
+			value = fn(*args, **kwargs)
+			frappe.cache.hset(cache_key, args_key, value)
+			return value
+		
+		# frappe.call reads the signature to decide which request args to pass on
+		wrapper.__signature__ = inspect.signature(fn)
+		return wrapper
+	
+	return decorator
+
+
+def versioned(name):
+	"""Let callers skip an endpoint whose dataset has not changed since their last fetch
+	
+	Callers that pass `version` (empty on the first fetch) get back either
+	{"version", "not_modified"} or {"version", "data"}; other callers get the data as before.
+	"""
+	if name not in DATASET_DEPENDENCIES:
+		raise ValueError(f"No dataset dependencies declared for {name}")
+	
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, version=None, **kwargs):
+			if version is None:
+				return fn(*args, **kwargs)
+			
+			current = get_dataset_version(name, args, kwargs)
+			if version == current:
+				return {"version": current, "not_modified": True}
+			
+			return {"version": current, "data": fn(*args, **kwargs)}
+		
+		signature = inspect.signature(fn)
+		wrapper.__signature__ = signature.replace(parameters=[
+			*signature.parameters.values(),
+			inspect.Parameter("version", inspect.Parameter.KEYWORD_ONLY, default=None)
+		])
+		return wrapper
+	
+	return decorator
+
+
+def get_dataset_version(name, args=(), kwargs=None):
+	"""Get the version stamp of a dataset from its doctype counters (one Redis read)"""
+	doctypes = DATASET_DEPENDENCIES[name]
+	key = frappe.cache.make_key(VERSIONS_KEY)
+	
+	# The epoch changes whenever the counters are lost, so old stamps never match again
+	frappe.cache.hsetnx(key, "epoch", frappe.generate_hash(length=8))
+	epoch, *counters = frappe.cache.hmget(key, ["epoch", *doctypes])
+	
+	counters = ".".join(str(int(counter or 0)) for counter in counters)
+	return f"{frappe.safe_decode(epoch)}.{counters}.{get_args_key(args, kwargs or {})[:12]}"
+
+
+def bump_doctype_version(doctype):
+	"""Change the version stamp of every dataset that reads from the given doctype"""
+	frappe.cache.hincrby(frappe.cache.make_key(VERSIONS_KEY), doctype, 1)
+
+
+def get_cached_member_profiles(members, builder):
+	"""Get member profiles from the cache, building any misses in one batch"""
+	values = frappe.cache.hmget(frappe.cache.make_key(MEMBER_PROFILE_KEY), members) if members else []
+	profiles = {
+		member: pickle.loads(value)
+		for member, value in zip(members, values)
+		if value is not None
+	}
+	
+	missing = [member for member in members if member not in profiles]
+	if missing:
+		for member, profile in builder(missing).items():
+			frappe.cache.hset(MEMBER_PROFILE_KEY, member, profile)
+			profiles[member] = profile
+	
+	return profiles
+
+
+def get_class_meta(class_name):
+	"""Get a class's fees, capacity, date and type without loading the full document"""
+	# hget memoises in frappe.local.cache, so repeated reads in a request skip Redis too
+	return frappe.cache.hget(CLASS_META_KEY, class_name,
+		generator=lambda: frappe.db.get_value("Dojo Class", class_name, CLASS_META_FIELDS, as_dict=True))
+
+
+def invalidate_class_meta(doc, method=None, *args, **kwargs):
+	"""doc_events handler that drops a changed class's cached metadata"""
+	frappe.cache.hdel(CLASS_META_KEY, doc.name)
+	frappe.cache.delete_key(KIOSK_CLASSES_KEY)
+	
+	# A concurrent reader can re-cache pre-commit values, so drop them again after commit
+	frappe.db.after_commit.add(functools.partial(frappe.cache.hdel, CLASS_META_KEY, doc.name))
+	frappe.db.after_commit.add(functools.partial(frappe.cache.delete_key, KIOSK_CLASSES_KEY))
+
+
+def invalidate_kiosk_member(doc, method=None, *args, **kwargs):
+	"""doc_events handler that drops the kiosk lookups of a changed member"""
+	previous = doc.get_doc_before_save()
+	codes = {doc.name, doc.get("checkin_pin"), previous.get("checkin_pin") if previous else None}
+	
+	for code in codes - {None, ""}:
+		frappe.cache.hdel(KIOSK_MEMBER_KEY, code)
+		frappe.db.after_commit.add(functools.partial(frappe.cache.hdel, KIOSK_MEMBER_KEY, code))
+
+
+def invalidate_member_profile(member):
+	"""Drop one member's cached profile"""
+	if member:
+		frappe.cache.hdel(MEMBER_PROFILE_KEY, member)
+
+
+def record_cache_stat(name, kind):
+	"""Increment the hit or miss counter for an aggregate"""
+	frappe.cache.hincrby(frappe.cache.make_key(CACHE_STATS_KEY), f"{name}:{kind}", 1)
+
+
+def invalidate_doctype(doctype):
+	"""Drop every cached aggregate that reads from the given doctype"""
+	for name, doctypes in CACHE_DEPENDENCIES.items():
+		if doctype in doctypes:
+			frappe.cache.delete_key(get_cache_key(name))
+
+
+def invalidate_for_doc(doc, method=None, *args, **kwargs):
+	"""doc_events handler that invalidates aggregates affected by a write"""
+	invalidate_doctype(doc.doctype)
+	
+	# A concurrent reader can re-cache pre-commit data, so clear again after commit
+	frappe.db.after_commit.add(functools.partial(invalidate_doctype, doc.doctype))
+	
+	# Bumping only after commit keeps a stamp from labelling pre-commit data
+	frappe.db.after_commit.add(functools.partial(bump_doctype_version, doc.doctype))
+	
+	if doc.doctype in MEMBER_PROFILE_DOCTYPES:
+		member = doc.name if doc.doctype == "Dojo Member" else doc.get("member")
+		invalidate_member_profile(member)
+		frappe.db.after_commit.add(functools.partial(invalidate_member_profile, member))
+
+
+def invalidate_for_bulk_update(doctype):
+	"""Invalidate aggregates and bump versions after a committed set-based UPDATE"""
+	invalidate_doctype(doctype)
+	bump_doctype_version(doctype)
+	
+	if doctype in MEMBER_PROFILE_DOCTYPES:
+		frappe.cache.delete_key(MEMBER_PROFILE_KEY)
+
+
+def clear_all():
+	"""Drop all cached aggregates and version stamps (called on bench clear-cache)"""
+	for name in CACHE_DEPENDENCIES:
+		frappe.cache.delete_key(get_cache_key(name))
+	
+	frappe.cache.delete(frappe.cache.make_key(VERSIONS_KEY))
+	frappe.cache.delete_key(MEMBER_PROFILE_KEY)
+	frappe.cache.delete_key(CLASS_META_KEY)
+	frappe.cache.delete_key(KIOSK_MEMBER_KEY)
+	frappe.cache.delete_key(KIOSK_CLASSES_KEY)
+
+
+@frappe.whitelist()
+def get_cache_stats():
+	"""Get hit and miss counters for the cached aggregates"""
+	frappe.only_for(["System Manager", "Dojo Manager"])
+	
+	fields = [f"{name}:{kind}" for name in CACHE_DEPENDENCIES for kind in ("hits", "misses")]
+	values = frappe.cache.hmget(frappe.cache.make_key(CACHE_STATS_KEY), fields)
+	counters = dict(zip(fields, values))
+	
+	stats = {}
+	for name in CACHE_DEPENDENCIES:
+		hits = int(counters[f"{name}:hits"] or 0)
+		misses = int(counters[f"{name}:misses"] or 0)
+		stats[name] = {
+			"hits": hits,
+			"misses": misses,
+			"hit_rate": (hits / (hits + misses) * 100) if hits + misses > 0 else 0
+		}
+	
+	return stats
+
+
+@frappe.whitelist()
+def reset_cache_stats():
+	"""Reset the hit and miss counters"""
+	frappe.only_for(["System Manager", "Dojo Manager"])
+	frappe.cache.delete(frappe.cache.make_key(CACHE_STATS_KEY))
\ No newline at end of file
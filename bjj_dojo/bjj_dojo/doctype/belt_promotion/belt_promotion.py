@@ -5,6 +5,8 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import today, date_diff, getdate
 
+from bjj_dojo.bjj_dojo.cache import cached_aggregate, versioned
+
 
 class BeltPromotion(Document):
 	def validate(self):
@@ -218,6 +220,8 @@ def get_promotion_history(member=None, limit=50):
 
 
 @frappe.whitelist()
+@versioned("get_belt_statistics")
+@cached_aggregate("get_belt_statistics")
 def get_belt_statistics():
 	"""Get belt distribution statistics"""
 	# Current belt distribution
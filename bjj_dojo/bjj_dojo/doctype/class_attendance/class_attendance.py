@@ -1,27 +1,51 @@
 # Copyright (c) 2024, Dojo Planner and contributors
 # For license information, please see license.txt
 
+import functools
+import json
+
 import frappe
 from frappe.model.document import Document
-from frappe.utils import flt
+from frappe.utils import flt, cint, now
+
+from bjj_dojo.bjj_dojo.cache import invalidate_doctype, invalidate_for_bulk_update, get_class_meta
+from bjj_dojo.bjj_dojo.realtime import publish_dashboard_update
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import update_daily_metrics
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import (
+	refresh_last_attendance_dates, get_attendance_counts, apply_attendance_counter_deltas,
+	rebuild_attendance_counters)
+
+
+ATTENDANCE_STATUSES = ("Present", "Absent", "Late", "Excused")
+MEMBER_TYPES = ("Member", "Drop-in", "Guest", "Trial")
+
+# Columns written by the batch path, and those it overwrites on an existing mark
+UPSERT_FIELDS = (
+	"name", "owner", "creation", "modified", "modified_by", "docstatus", "idx",
+	"class", "class_name", "class_date", "member", "member_name", "member_type", "status",
+	"check_in_time", "payment_required", "payment_amount", "payment_status", "notes"
+)
+UPSERT_UPDATE_FIELDS = (
+	"modified", "modified_by", "class_name", "class_date", "member_name", "member_type",
+	"status", "payment_amount", "payment_status", "notes"
+)
+
+# Lock waits and deadlocks fail the whole request so callers can retry it, rather
+# than being reported as a failed row
+TRANSIENT_WRITE_ERRORS = (frappe.QueryDeadlockError, frappe.QueryTimeoutError)
 
 
 class ClassAttendance(Document):
 	def validate(self):
-		self.validate_duplicate_attendance()
 		self.set_payment_details()
 		
-	def validate_duplicate_attendance(self):
-		"""Prevent duplicate attendance records for same member and class"""
-		existing = frappe.db.get_value("Class Attendance", 
-			{
-				"class": self.class_,
-				"member": self.member,
-				"name": ("!=", self.name)
-			}, "name")
+	def show_unique_validation_message(self, e):
+		"""Duplicate (class, member) marks are rejected by the unique index; explain it readably"""
+		if "unique_class_member" in str(e):
+			frappe.throw(f"Attendance already marked for {self.member_name} in this class",
+				frappe.UniqueValidationError)
 		
-		if existing:
-			frappe.throw(f"Attendance already marked for {self.member_name} in this class")
+		super().show_unique_validation_message(e)
 	
 	def set_payment_details(self):
 		"""Set payment details based on member type and class fees"""
@@ -31,22 +55,8 @@ class ClassAttendance(Document):
 			return
 		
 		# Get class details
-		class_doc = frappe.get_doc("Dojo Class", self.class_)
-		
-		# Set payment amount based on member type
-		if self.member_type == "Drop-in":
-			self.payment_amount = class_doc.drop_in_fee or 0
-		elif self.member_type == "Member":
-			self.payment_amount = class_doc.member_fee or 0
-		elif self.member_type == "Trial":
-			self.payment_amount = 0  # Trial classes are usually free
-			self.payment_status = "Waived"
-		elif self.member_type == "Guest":
-			self.payment_amount = class_doc.drop_in_fee or 0
-		
-		# Set default payment status
-		if self.payment_status == "Not Required" and self.payment_amount > 0:
-			self.payment_status = "Pending"
+		self.payment_amount, self.payment_status = get_payment_details(
+			self.member_type, self.payment_status, get_class_meta(self.class_), self.payment_amount)
 	
 	def on_update(self):
 		"""Called after document is updated"""
@@ -58,15 +68,46 @@ class ClassAttendance(Document):
 	
 	def update_class_stats(self):
 		"""Update attendance count and revenue for the class"""
-		class_doc = frappe.get_doc("Dojo Class", self.class_)
-		class_doc.update_attendance_stats()
+		update_class_attendance_stats(get_class_meta(self.class_))
 	
 	def update_member_stats(self):
 		"""Update member's attendance statistics"""
+		previous = self.get_doc_before_save()
+		
 		if self.status == "Present":
-			# Update member's last attendance date
-			frappe.db.set_value("Dojo Member", self.member, 
-				"last_attendance_date", self.class_date)
+			# Move the member's last attendance date forward, never back
+			frappe.db.sql("""
+				UPDATE `tabDojo Member`
+				SET last_attendance_date = %(class_date)s
+				WHERE name = %(member)s
+					AND (last_attendance_date IS NULL OR last_attendance_date < %(class_date)s)
+			""", {"member": self.member, "class_date": self.class_date})
+		
+		if previous and previous.status == "Present" and (
+			self.status != "Present" or previous.member != self.member
+			or previous.class_date != self.class_date):
+			# A present mark was withdrawn or moved; recompute from history
+			refresh_last_attendance_dates([previous.member])
+		
+		self.update_member_counters(previous)
+	
+	def update_member_counters(self, previous=None, deleted=False):
+		"""Move the member attendance counters by the difference this write made"""
+		deltas = {}
+		for doc, sign in ((previous, -1), (None if deleted else self, 1)):
+			if doc:
+				counts = deltas.setdefault(doc.member, dict.fromkeys(get_attendance_counts(doc), 0))
+				for fieldname, count in get_attendance_counts(doc).items():
+					counts[fieldname] += sign * count
+		
+		apply_attendance_counter_deltas(deltas)
+	
+	def after_delete(self):
+		"""Called after the attendance record is deleted"""
+		if self.status == "Present":
+			refresh_last_attendance_dates([self.member])
+		
+		self.update_member_counters(previous=self, deleted=True)
 	
 	def mark_payment_received(self, amount=None):
 		"""Mark payment as received"""
@@ -116,62 +157,256 @@ class ClassAttendance(Document):
 		return payment_doc.name
 
 
+def on_doctype_update():
+	"""Add composite indexes for per-member attendance lookups"""
+	frappe.db.add_index("Class Attendance", ["member", "status", "class_date"])
+	
+	# One mark per member and class; concurrent check-ins resolve to an update
+	frappe.db.add_unique("Class Attendance", ["class", "member"], constraint_name="unique_class_member")
+
+
+def update_class_attendance_stats(class_meta):
+	"""Recompute a class's attendance count and revenue from its fees"""
+	data = frappe.db.sql("""
+		SELECT 
+			COUNT(*) as total_attendees,
+			COUNT(CASE WHEN member_type = 'Drop-in' THEN 1 END) as drop_ins,
+			COUNT(CASE WHEN member_type = 'Member' THEN 1 END) as members
+		FROM `tabClass Attendance`
+		WHERE class = %s AND status = 'Present'
+	""", class_meta.name, as_dict=True)[0]
+	
+	# Calculate revenue
+	drop_in_revenue = flt(data.drop_ins) * flt(class_meta.drop_in_fee or 0)
+	member_revenue = flt(data.members) * flt(class_meta.member_fee or 0)
+	values = {
+		"attendance_count": data.total_attendees,
+		"total_revenue": drop_in_revenue + member_revenue
+	}
+	
+	# Update without triggering validation again
+	frappe.db.set_value("Dojo Class", class_meta.name, values, update_modified=False)
+	return values
+
+
+def get_payment_details(member_type, payment_status, class_fees, payment_amount=0):
+	"""Get (payment_amount, payment_status) for a paid mark from the member type and class fees"""
+	# Set payment amount based on member type
+	if member_type == "Drop-in":
+		payment_amount = class_fees.drop_in_fee or 0
+	elif member_type == "Member":
+		payment_amount = class_fees.member_fee or 0
+	elif member_type == "Trial":
+		payment_amount = 0  # Trial classes are usually free
+		payment_status = "Waived"
+	elif member_type == "Guest":
+		payment_amount = class_fees.drop_in_fee or 0
+	
+	# Set default payment status
+	if payment_status == "Not Required" and flt(payment_amount) > 0:
+		payment_status = "Pending"
+	
+	return payment_amount, payment_status
+
+
 @frappe.whitelist()
 def bulk_mark_attendance(class_name, attendance_data):
-	"""Bulk mark attendance for multiple members"""
-	import json
-	
+	"""Bulk mark attendance for multiple members with batched reads and writes"""
 	if isinstance(attendance_data, str):
 		attendance_data = json.loads(attendance_data)
 	
+	frappe.has_permission("Class Attendance", "create", throw=True)
+	frappe.has_permission("Class Attendance", "write", throw=True)
+	
+	return upsert_attendance(class_name, attendance_data)
+
+
+def upsert_attendance(class_name, entries):
+	"""Mark attendance for members of a class through the (class, member) upsert path"""
+	class_doc = get_class_meta(class_name)
+	if not class_doc:
+		frappe.throw(f"Dojo Class {class_name} not found", frappe.DoesNotExistError)
+	
+	# One query each for the members and their existing marks in the class
+	members = list({data.get("member") for data in entries if data.get("member")})
+	member_names = dict(frappe.get_all("Dojo Member",
+		filters={"name": ["in", members]},
+		fields=["name", "member_name"],
+		as_list=True
+	)) if members else {}
+	
+	existing = {
+		row.member: row
+		for row in frappe.get_all("Class Attendance",
+			filters={"class": class_name, "member": ["in", members]},
+			fields=["name", "member", "status", "class_date", "member_type", "payment_required", "payment_status", "notes"]
+		)
+	} if members else {}
+	
 	results = []
+	pending = []
+	seen = set()
+	timestamp = now()
 	
-	for data in attendance_data:
+	for data in entries:
+		member = data.get("member")
+		result = {"member": member}
+		results.append(result)
+		
 		try:
-			# Check if attendance already exists
-			existing = frappe.db.get_value("Class Attendance",
-				{
-					"class": class_name,
-					"member": data.get("member")
-				}, "name")
-			
-			if existing:
-				# Update existing record
-				attendance_doc = frappe.get_doc("Class Attendance", existing)
-				attendance_doc.status = data.get("status", "Present")
-				attendance_doc.member_type = data.get("member_type", "Member")
-				attendance_doc.notes = data.get("notes", "")
-				attendance_doc.save()
-			else:
-				# Create new record
-				member_doc = frappe.get_doc("Dojo Member", data.get("member"))
-				attendance_doc = frappe.get_doc({
-					"doctype": "Class Attendance",
-					"class": class_name,
-					"member": data.get("member"),
-					"member_name": member_doc.member_name,
-					"status": data.get("status", "Present"),
-					"member_type": data.get("member_type", "Member"),
-					"notes": data.get("notes", "")
-				})
-				attendance_doc.insert()
-			
-			results.append({
-				"member": data.get("member"),
-				"status": "success",
-				"attendance_id": attendance_doc.name
-			})
+			if member in seen:
+				frappe.throw(f"Member {member} is listed more than once")
+			seen.add(member)
 			
-		except Exception as e:
-			results.append({
-				"member": data.get("member"),
-				"status": "error",
-				"error": str(e)
-			})
+			row = build_attendance_row(class_doc, data, member_names, existing.get(member), timestamp)
+		except frappe.ValidationError as e:
+			result.update({"status": "error", "error": str(e)})
+			continue
+		
+		result.update({"status": "success", "attendance_id": row["name"]})
+		pending.append((result, row))
+	
+	written = write_attendance_rows(pending)
+	if written:
+		# A mark inserted concurrently keeps its own name when our insert became an update
+		names = dict(frappe.get_all("Class Attendance",
+			filters={"class": class_name, "member": ["in", [row["member"] for row in written]]},
+			fields=["member", "name"],
+			as_list=True
+		))
+		for result in results:
+			if result["status"] == "success":
+				result["attendance_id"] = names.get(result["member"], result["attendance_id"])
+		
+		finish_bulk_attendance(class_doc, written, existing)
 	
 	return results
 
 
+def build_attendance_row(class_doc, data, member_names, existing, timestamp):
+	"""Validate one bulk attendance entry and build its row without queries"""
+	member = data.get("member")
+	if member not in member_names:
+		frappe.throw(f"Dojo Member {member} not found", frappe.DoesNotExistError)
+	
+	status = data.get("status") or "Present"
+	if status not in ATTENDANCE_STATUSES:
+		frappe.throw(f"Invalid attendance status {status}")
+	
+	# A check-in that does not say otherwise keeps a pre-registered Drop-in, Guest or Trial mark's type
+	member_type = data.get("member_type") or (existing.member_type if existing else None) or "Member"
+	if member_type not in MEMBER_TYPES:
+		frappe.throw(f"Invalid member type {member_type}")
+	
+	payment_required = cint(existing.payment_required if existing else data.get("payment_required"))
+	payment_amount, payment_status = 0, "Not Required"
+	if payment_required:
+		payment_amount, payment_status = get_payment_details(member_type,
+			(existing.payment_status if existing else None) or "Not Required", class_doc)
+	
+	return {
+		"name": existing.name if existing else frappe.generate_hash(length=10),
+		"owner": frappe.session.user,
+		"creation": timestamp,
+		"modified": timestamp,
+		"modified_by": frappe.session.user,
+		"docstatus": 0,
+		"idx": 0,
+		"class": class_doc.name,
+		"class_name": class_doc.class_name,
+		"class_date": class_doc.class_date,
+		"member": member,
+		"member_name": member_names[member],
+		"member_type": member_type,
+		"status": status,
+		"check_in_time": timestamp,
+		"payment_required": payment_required,
+		"payment_amount": payment_amount,
+		"payment_status": payment_status,
+		"notes": data.get("notes") if data.get("notes") is not None else (existing.notes if existing else "")
+	}
+
+
+def upsert_attendance_rows(rows):
+	"""Insert new marks and overwrite existing ones with one multi-row statement"""
+	# Either the name or the unique (class, member) key turns a repeated mark into an update
+	columns = ", ".join(f"`{fieldname}`" for fieldname in UPSERT_FIELDS)
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * len(UPSERT_FIELDS)) + ")"] * len(rows))
+	updates = ", ".join(f"`{fieldname}` = VALUES(`{fieldname}`)" for fieldname in UPSERT_UPDATE_FIELDS)
+	
+	frappe.db.sql(f"""
+		INSERT INTO `tabClass Attendance` ({columns})
+		VALUES {placeholders}
+		ON DUPLICATE KEY UPDATE {updates}
+	""", [row[fieldname] for row in rows for fieldname in UPSERT_FIELDS])
+
+
+def write_attendance_rows(pending):
+	"""Write validated rows in one statement, isolating failing rows with savepoints"""
+	if not pending:
+		return []
+	
+	frappe.db.savepoint("bulk_attendance")
+	try:
+		upsert_attendance_rows([row for result, row in pending])
+		frappe.db.release_savepoint("bulk_attendance")
+		return [row for result, row in pending]
+	except TRANSIENT_WRITE_ERRORS:
+		raise
+	except Exception:
+		frappe.db.rollback(save_point="bulk_attendance")
+	
+	# Something in the batch failed; write row by row so each row lands whole or not at all
+	written = []
+	for result, row in pending:
+		frappe.db.savepoint("bulk_attendance_row")
+		try:
+			upsert_attendance_rows([row])
+			frappe.db.release_savepoint("bulk_attendance_row")
+			written.append(row)
+		except TRANSIENT_WRITE_ERRORS:
+			raise
+		except Exception as e:
+			frappe.db.rollback(save_point="bulk_attendance_row")
+			result.pop("attendance_id")
+			result.update({"status": "error", "error": str(e)})
+	
+	return written
+
+
+def finish_bulk_attendance(class_doc, rows, existing):
+	"""Apply the side effects of per-row saves once for the whole batch"""
+	members = [row["member"] for row in rows]
+	refresh_last_attendance_dates(members)
+	rebuild_attendance_counters(members)
+	
+	update_class_attendance_stats(class_doc)
+	
+	# Net check-in change per day, counting marks that moved off another date
+	check_ins = {}
+	for row in rows:
+		previous = existing.get(row["member"])
+		if previous and previous.status == "Present":
+			check_ins[previous.class_date] = check_ins.get(previous.class_date, 0) - 1
+		if row["status"] == "Present":
+			check_ins[row["class_date"]] = check_ins.get(row["class_date"], 0) + 1
+	
+	for class_date in set(check_ins) | {class_doc.class_date}:
+		update_daily_metrics(class_date, ("attendance",))
+	
+	invalidate_doctype("Class Attendance")
+	frappe.db.after_commit.add(functools.partial(invalidate_for_bulk_update, "Class Attendance"))
+	frappe.db.after_commit.add(functools.partial(invalidate_for_bulk_update, "Dojo Member"))
+	
+	for class_date, delta in check_ins.items():
+		if delta and class_date:
+			publish_dashboard_update("check_in",
+				class_date=str(class_date),
+				delta=delta,
+				class_name=class_doc.class_name
+			)
+
+
 @frappe.whitelist()
 def get_class_attendance_summary(class_name):
 	"""Get attendance summary for a class"""
@@ -225,52 +460,54 @@ def get_attendance_analytics(start_date=None, end_date=None):
 	params = []
 	
 	if start_date:
-		conditions.append("ca.class_date >= %s")
+		conditions.append("fact_date >= %s")
 		params.append(start_date)
 	
 	if end_date:
-		conditions.append("ca.class_date <= %s")
+		conditions.append("fact_date <= %s")
 		params.append(end_date)
 	
 	where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
 	
-	# Attendance by class type
+	# Attendance by class type, read from the attendance fact rollup
 	class_type_stats = frappe.db.sql(f"""
 		SELECT 
-			dc.class_type,
-			COUNT(ca.name) as total_attendance,
-			COUNT(CASE WHEN ca.status = 'Present' THEN 1 END) as present_count,
-			AVG(CASE WHEN ca.status = 'Present' THEN 1 ELSE 0 END) * 100 as attendance_rate
-		FROM `tabClass Attendance` ca
-		JOIN `tabDojo Class` dc ON ca.class = dc.name
+			NULLIF(class_type, '') as class_type,
+			SUM(attendance_count) as total_attendance,
+			SUM(IF(status = 'Present', attendance_count, 0)) as present_count,
+			SUM(IF(status = 'Present', attendance_count, 0)) * 100 / SUM(attendance_count) as attendance_rate
+		FROM `tabDojo Attendance Fact`
 		{where_clause}
-		GROUP BY dc.class_type
+		GROUP BY class_type
 		ORDER BY total_attendance DESC
 	""", params, as_dict=True)
 	
 	# Member type distribution
 	member_type_stats = frappe.db.sql(f"""
 		SELECT 
-			ca.member_type,
-			COUNT(ca.name) as count,
-			SUM(CASE WHEN ca.payment_required = 1 AND ca.payment_status = 'Paid' THEN ca.payment_amount ELSE 0 END) as revenue
-		FROM `tabClass Attendance` ca
-		JOIN `tabDojo Class` dc ON ca.class = dc.name
+			NULLIF(member_type, '') as member_type,
+			SUM(attendance_count) as count,
+			SUM(paid_revenue) as revenue
+		FROM `tabDojo Attendance Fact`
 		{where_clause}
-		GROUP BY ca.member_type
+		GROUP BY member_type
 	""", params, as_dict=True)
 	
-	# Daily attendance trends
+	# Daily attendance trends, read from the daily rollup
+	daily_conditions = ["attendance_count > 0"]
+	if start_date:
+		daily_conditions.append("metric_date >= %s")
+	if end_date:
+		daily_conditions.append("metric_date <= %s")
+	
 	daily_trends = frappe.db.sql(f"""
 		SELECT 
-			ca.class_date,
-			COUNT(ca.name) as total_registered,
-			COUNT(CASE WHEN ca.status = 'Present' THEN 1 END) as present_count
-		FROM `tabClass Attendance` ca
-		JOIN `tabDojo Class` dc ON ca.class = dc.name
-		{where_clause}
-		GROUP BY ca.class_date
-		ORDER BY ca.class_date
+			metric_date as class_date,
+			attendance_count as total_registered,
+			check_ins as present_count
+		FROM `tabDojo Daily Metrics`
+		WHERE {" AND ".join(daily_conditions)}
+		ORDER BY metric_date
 	""", params, as_dict=True)
 	
 	return {
@@ -0,0 +1,59 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+
+class DojoAttendanceFact(Document):
+	pass
+
+
+def update_attendance_facts(from_date, to_date=None):
+	"""Rebuild the (date, class type, member type, status) attendance rollup for a date range"""
+	if not from_date:
+		return
+	
+	from_date = getdate(from_date)
+	to_date = getdate(to_date or from_date)
+	
+	frappe.db.sql("""
+		DELETE FROM `tabDojo Attendance Fact`
+		WHERE fact_date BETWEEN %(from_date)s AND %(to_date)s
+	""", {"from_date": from_date, "to_date": to_date})
+	
+	# Names derive from the grouping key, so each fact row has exactly one name
+	frappe.db.sql("""
+		INSERT INTO `tabDojo Attendance Fact`
+			(name, owner, creation, modified, modified_by, docstatus, idx,
+			fact_date, class_type, member_type, status, attendance_count, paid_revenue)
+		SELECT
+			LEFT(MD5(CONCAT_WS(':', ca.class_date, IFNULL(dc.class_type, ''), IFNULL(ca.member_type, ''), IFNULL(ca.status, ''))), 10),
+			%(user)s, %(timestamp)s, %(timestamp)s, %(user)s, 0, 0,
+			ca.class_date, IFNULL(dc.class_type, ''), IFNULL(ca.member_type, ''), IFNULL(ca.status, ''),
+			COUNT(*),
+			SUM(CASE WHEN ca.payment_required = 1 AND ca.payment_status = 'Paid' THEN ca.payment_amount ELSE 0 END)
+		FROM `tabClass Attendance` ca
+		JOIN `tabDojo Class` dc ON ca.class = dc.name
+		WHERE ca.class_date BETWEEN %(from_date)s AND %(to_date)s
+		GROUP BY ca.class_date, IFNULL(dc.class_type, ''), IFNULL(ca.member_type, ''), IFNULL(ca.status, '')
+	""", {"from_date": from_date, "to_date": to_date, "user": frappe.session.user, "timestamp": now()})
+
+
+def refresh_for_class(doc, method=None, *args, **kwargs):
+	"""doc_events handler that moves a class's attendance facts when its class type changes"""
+	if not doc.has_value_changed("class_type"):
+		return
+	
+	for fact_date in frappe.get_all("Class Attendance",
+		filters={"class": doc.name},
+		distinct=True,
+		pluck="class_date"
+	):
+		update_attendance_facts(fact_date)
+
+
+def get_earliest_fact_date():
+	"""Get the first date with attendance to roll up"""
+	return frappe.db.sql("SELECT MIN(class_date) FROM `tabClass Attendance`")[0][0]
\ No newline at end of file
@@ -0,0 +1,186 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now, today, getdate, get_first_day, get_last_day, flt, cint
+
+from bjj_dojo.bjj_dojo.cache import invalidate_for_bulk_update
+from bjj_dojo.bjj_dojo.naming import reserve_series_names
+
+
+PAYMENT_NAMING_SERIES = "PAY-.YYYY.-"
+
+PAYMENT_FIELDS = (
+	"name", "owner", "creation", "modified", "modified_by", "docstatus", "idx", "naming_series",
+	"member", "member_name", "payment_type", "amount", "net_amount", "payment_date",
+	"payment_method", "status", "description", "billing_period", "billing_run"
+)
+
+
+class DojoBillingRun(Document):
+	def validate(self):
+		self.billing_period = getdate(self.billing_date).strftime("%Y-%m")
+		
+		if flt(self.late_fee) < 0:
+			frappe.throw("Late fee cannot be negative")
+	
+	@frappe.whitelist()
+	def run(self):
+		"""Start the run, or resume it after the last committed chunk"""
+		self.check_permission("write")
+		run_billing(self.name)
+		self.reload()
+
+
+def run_billing(billing_run, chunk_size=1000):
+	"""Bill every due member in keyset-ordered chunks, committing a checkpoint per chunk"""
+	run = frappe.get_doc("Dojo Billing Run", billing_run)
+	if run.status == "Completed":
+		return run
+	
+	frappe.db.set_value("Dojo Billing Run", run.name, {
+		"status": "Running",
+		"started_at": run.started_at or now(),
+		"error_log": None
+	}, update_modified=False)
+	frappe.db.commit()
+	
+	last_member = run.last_member or ""
+	
+	try:
+		while True:
+			dues = get_member_dues(run, last_member, chunk_size)
+			if not dues:
+				break
+			
+			payments, members, amount = insert_billing_payments(run, dues)
+			last_member = dues[-1].name
+			
+			# The checkpoint commits with the chunk's payments, so a restart resumes after it
+			frappe.db.sql("""
+				UPDATE `tabDojo Billing Run`
+				SET last_member = %(last_member)s,
+					payments_created = payments_created + %(payments)s,
+					members_billed = members_billed + %(members)s,
+					total_amount = IFNULL(total_amount, 0) + %(amount)s
+				WHERE name = %(name)s
+			""", {"name": run.name, "last_member": last_member, "payments": payments, "members": members, "amount": amount})
+			frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		frappe.db.set_value("Dojo Billing Run", run.name, {
+			"status": "Failed",
+			"error_log": frappe.get_traceback()
+		}, update_modified=False)
+		frappe.db.commit()
+		frappe.log_error(f"Dojo Billing Run {run.name} failed after member {last_member or '(none)'}")
+		raise
+	
+	frappe.db.set_value("Dojo Billing Run", run.name, {
+		"status": "Completed",
+		"finished_at": now()
+	}, update_modified=False)
+	frappe.db.commit()
+	invalidate_for_bulk_update("Dojo Payment")
+	
+	return frappe.get_doc("Dojo Billing Run", run.name)
+
+
+def get_member_dues(run, after, limit):
+	"""Compute dues, prorations and late fees for the next chunk of due members in one query"""
+	billing_date = getdate(run.billing_date)
+	params = {
+		"after": after,
+		"limit": cint(limit),
+		"billing_date": billing_date,
+		"period_start": get_first_day(billing_date),
+		"period_end": get_last_day(billing_date),
+		"month": billing_date.strftime("%Y-%m"),
+		"year": billing_date.strftime("%Y"),
+		"prorate": cint(run.prorate_first_month),
+		"late_fee": flt(run.late_fee)
+	}
+	
+	# Annual members are billed once per year, everyone else once per month
+	return frappe.db.sql("""
+		SELECT m.name, m.member_name, m.membership_type,
+			IF(m.membership_type = 'Annual', 'Annual Membership', 'Monthly Membership') as payment_type,
+			IF(m.membership_type = 'Annual', %(year)s, %(month)s) as billing_period,
+			CASE
+				WHEN m.membership_type = 'Annual' THEN m.monthly_fee * 12
+				WHEN %(prorate)s AND m.last_payment_date IS NULL AND m.join_date > %(period_start)s
+					THEN ROUND(m.monthly_fee * (DATEDIFF(%(period_end)s, m.join_date) + 1) / DAY(%(period_end)s), 2)
+				ELSE m.monthly_fee
+			END as amount,
+			IF(m.payment_status = 'Overdue', %(late_fee)s, 0) as late_fee
+		FROM `tabDojo Member` m
+		WHERE m.name > %(after)s
+			AND m.status = 'Active'
+			AND m.membership_type != 'Drop-in'
+			AND IFNULL(m.monthly_fee, 0) > 0
+			AND (m.next_payment_due <= %(period_end)s
+				OR (m.last_payment_date IS NULL AND m.join_date BETWEEN %(period_start)s AND %(billing_date)s))
+			AND NOT EXISTS (
+				SELECT 1 FROM `tabDojo Payment` p
+				WHERE p.member = m.name
+					AND p.billing_period = IF(m.membership_type = 'Annual', %(year)s, %(month)s)
+					AND p.payment_type = IF(m.membership_type = 'Annual', 'Annual Membership', 'Monthly Membership')
+			)
+		ORDER BY m.name
+		LIMIT %(limit)s
+	""", params, as_dict=True)
+
+
+def insert_billing_payments(run, dues):
+	"""Create Pending payments for a chunk of dues with one multi-row insert"""
+	rows = []
+	for due in dues:
+		rows.append((due, due.payment_type, flt(due.amount), due.billing_period))
+		if flt(due.late_fee) > 0:
+			rows.append((due, "Late Fee", flt(due.late_fee), run.billing_period))
+	
+	names = reserve_series_names(PAYMENT_NAMING_SERIES, len(rows))
+	timestamp = now()
+	values = [
+		(name, frappe.session.user, timestamp, timestamp, frappe.session.user, 0, 0, PAYMENT_NAMING_SERIES,
+			due.name, due.member_name, payment_type, amount, amount, run.billing_date,
+			"Other", "Pending", f"{payment_type} for {billing_period}", billing_period, run.name)
+		for name, (due, payment_type, amount, billing_period) in zip(names, rows)
+	]
+	
+	# The unique (member, billing_period, payment_type) key drops any row a concurrent
+	# run already created, so a member is never billed twice for a period
+	frappe.db.bulk_insert("Dojo Payment", fields=PAYMENT_FIELDS, values=values, ignore_duplicates=True)
+	
+	created = frappe.db.sql("""
+		SELECT COUNT(*) as payments, COUNT(DISTINCT member) as members, IFNULL(SUM(amount), 0) as amount
+		FROM `tabDojo Payment`
+		WHERE name IN %(names)s
+	""", {"names": tuple(names)}, as_dict=True)[0]
+	
+	return created.payments, created.members, flt(created.amount)
+
+
+def create_monthly_billing_run():
+	"""Monthly job: bill the new month, resuming this month's run if one was interrupted"""
+	billing_period = getdate(today()).strftime("%Y-%m")
+	existing = frappe.get_all("Dojo Billing Run",
+		filters={"billing_period": billing_period},
+		fields=["name", "status"],
+		order_by="creation desc",
+		limit=1
+	)
+	
+	if existing and existing[0].status == "Completed":
+		return
+	
+	if existing:
+		billing_run = existing[0].name
+	else:
+		run = frappe.get_doc({"doctype": "Dojo Billing Run", "billing_date": today()})
+		run.insert(ignore_permissions=True)
+		frappe.db.commit()
+		billing_run = run.name
+	
+	run_billing(billing_run)
\ No newline at end of file
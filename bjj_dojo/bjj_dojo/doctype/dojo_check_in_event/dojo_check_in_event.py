@@ -0,0 +1,8 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class DojoCheckinEvent(Document):
+	pass
\ No newline at end of file
@@ -3,9 +3,12 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import time_diff_in_seconds, flt, get_datetime
+from frappe.utils import time_diff_in_seconds, get_datetime
 from datetime import datetime, timedelta
 
+from bjj_dojo.bjj_dojo.cache import versioned
+from bjj_dojo.bjj_dojo.doctype.class_attendance.class_attendance import upsert_attendance, update_class_attendance_stats
+
 
 class DojoClass(Document):
 	def validate(self):
@@ -37,30 +40,7 @@ class DojoClass(Document):
 		
 	def update_attendance_stats(self):
 		"""Update attendance count and revenue"""
-		# Get attendance count
-		attendance_data = frappe.db.sql("""
-			SELECT 
-				COUNT(*) as total_attendees,
-				COUNT(CASE WHEN member_type = 'Drop-in' THEN 1 END) as drop_ins,
-				COUNT(CASE WHEN member_type = 'Member' THEN 1 END) as members
-			FROM `tabClass Attendance`
-			WHERE class = %s AND status = 'Present'
-		""", self.name, as_dict=True)
-		
-		if attendance_data:
-			data = attendance_data[0]
-			self.attendance_count = data.total_attendees
-			
-			# Calculate revenue
-			drop_in_revenue = flt(data.drop_ins) * flt(self.drop_in_fee or 0)
-			member_revenue = flt(data.members) * flt(self.member_fee or 0)
-			self.total_revenue = drop_in_revenue + member_revenue
-			
-			# Update without triggering validation again
-			frappe.db.set_value("Dojo Class", self.name, {
-				"attendance_count": self.attendance_count,
-				"total_revenue": self.total_revenue
-			}, update_modified=False)
+		self.update(update_class_attendance_stats(self))
 	
 	def get_attendance_list(self):
 		"""Get list of attendees for this class"""
@@ -72,37 +52,7 @@ class DojoClass(Document):
 	
 	def mark_attendance(self, member, status="Present", member_type="Member", notes=None):
 		"""Mark attendance for a member"""
-		# Check if attendance already exists
-		existing = frappe.db.get_value("Class Attendance", 
-			{"class": self.name, "member": member}, "name")
-		
-		if existing:
-			# Update existing attendance
-			attendance_doc = frappe.get_doc("Class Attendance", existing)
-			attendance_doc.status = status
-			attendance_doc.member_type = member_type
-			if notes:
-				attendance_doc.notes = notes
-			attendance_doc.save()
-		else:
-			# Create new attendance record
-			member_doc = frappe.get_doc("Dojo Member", member)
-			attendance_doc = frappe.get_doc({
-				"doctype": "Class Attendance",
-				"class": self.name,
-				"class_name": self.class_name,
-				"member": member,
-				"member_name": member_doc.member_name,
-				"status": status,
-				"member_type": member_type,
-				"check_in_time": frappe.utils.now(),
-				"notes": notes or ""
-			})
-			attendance_doc.insert()
-		
-		# Update class stats
-		self.update_attendance_stats()
-		return attendance_doc
+		return mark_member_attendance(self.name, member, status, member_type, notes)
 	
 	def get_class_schedule_conflicts(self):
 		"""Check for scheduling conflicts with other classes"""
@@ -190,6 +140,7 @@ def get_class_dashboard_data(class_name):
 
 
 @frappe.whitelist()
+@versioned("get_weekly_schedule")
 def get_weekly_schedule(start_date=None):
 	"""Get weekly class schedule"""
 	if not start_date:
@@ -221,8 +172,28 @@ def get_weekly_schedule(start_date=None):
 @frappe.whitelist()
 def mark_class_attendance(class_name, member, status="Present", member_type="Member", notes=None):
 	"""Mark attendance for a member in a class"""
-	class_doc = frappe.get_doc("Dojo Class", class_name)
-	return class_doc.mark_attendance(member, status, member_type, notes)
+	return mark_member_attendance(class_name, member, status, member_type, notes)
+
+
+def mark_member_attendance(class_name, member, status="Present", member_type="Member", notes=None):
+	"""Mark one member's attendance without loading the class document"""
+	# The raw upsert skips document permission checks, so check them here
+	frappe.has_permission("Class Attendance", "create", throw=True)
+	if frappe.db.exists("Class Attendance", {"class": class_name, "member": member}):
+		frappe.has_permission("Class Attendance", "write", throw=True)
+	
+	# The upsert path inserts or updates the (class, member) mark and refreshes class stats
+	result = upsert_attendance(class_name, [{
+		"member": member,
+		"status": status,
+		"member_type": member_type,
+		"notes": notes or None
+	}])[0]
+	
+	if result["status"] == "error":
+		frappe.throw(result["error"])
+	
+	return frappe.get_doc("Class Attendance", result["attendance_id"])
 
 
 @frappe.whitelist()
@@ -0,0 +1,242 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, today, flt
+
+from bjj_dojo.bjj_dojo.doctype.dojo_attendance_fact.dojo_attendance_fact import update_attendance_facts
+
+
+METRIC_SECTIONS = ("revenue", "members", "attendance", "promotions")
+
+# Source doctype -> (date fields, rollup section they feed)
+SOURCE_DOCTYPES = {
+	"Dojo Payment": (("payment_date",), "revenue"),
+	"Dojo Member": (("join_date", "cancellation_date"), "members"),
+	"Class Attendance": (("class_date",), "attendance"),
+	"Belt Promotion": (("promotion_date",), "promotions")
+}
+
+
+class DojoDailyMetrics(Document):
+	pass
+
+
+def update_daily_metrics(metric_date, sections=METRIC_SECTIONS):
+	"""Recompute the given sections of one day's rollup from source rows"""
+	if not metric_date:
+		return
+	
+	metric_date = getdate(metric_date)
+	values = {}
+	breakdown = None
+	
+	if "revenue" in sections:
+		breakdown = get_revenue_breakdown(metric_date, metric_date).get(metric_date, [])
+		values.update(get_revenue_totals(breakdown))
+	
+	if "members" in sections:
+		values["new_members"] = frappe.db.count("Dojo Member", {"join_date": metric_date})
+		values["cancellations"] = frappe.db.count("Dojo Member", {"cancellation_date": metric_date})
+	
+	if "attendance" in sections:
+		attendance = frappe.db.sql("""
+			SELECT
+				COUNT(*) as attendance_count,
+				COUNT(CASE WHEN status = 'Present' THEN 1 END) as check_ins
+			FROM `tabClass Attendance`
+			WHERE class_date = %s
+		""", metric_date, as_dict=True)[0]
+		values["attendance_count"] = attendance.attendance_count
+		values["check_ins"] = attendance.check_ins
+		update_attendance_facts(metric_date)
+	
+	if "promotions" in sections:
+		values["promotions"] = frappe.db.count("Belt Promotion", {
+			"promotion_date": metric_date,
+			"docstatus": 1
+		})
+	
+	save_daily_metrics(metric_date, values, breakdown)
+
+
+def save_daily_metrics(metric_date, values, breakdown=None):
+	"""Write one day's rollup row, creating it on first use"""
+	name = str(metric_date)
+	
+	if breakdown is None and frappe.db.exists("Dojo Daily Metrics", name):
+		frappe.db.set_value("Dojo Daily Metrics", name, values, update_modified=False)
+		return
+	
+	if frappe.db.exists("Dojo Daily Metrics", name):
+		doc = frappe.get_doc("Dojo Daily Metrics", name)
+	else:
+		doc = frappe.new_doc("Dojo Daily Metrics")
+		doc.metric_date = metric_date
+	
+	doc.update(values)
+	
+	if breakdown is not None:
+		doc.set("revenue_breakdown", [])
+		for row in breakdown:
+			doc.append("revenue_breakdown", {
+				"payment_type": row.payment_type,
+				"payment_method": row.payment_method,
+				"amount": row.amount,
+				"payment_count": row.payment_count
+			})
+	
+	doc.flags.ignore_permissions = True
+	try:
+		doc.save()
+	except frappe.DuplicateEntryError:
+		# Another request created the day first; write over it instead
+		save_daily_metrics(metric_date, values, breakdown)
+
+
+def get_revenue_breakdown(from_date, to_date):
+	"""Get revenue net of refunds per day, payment type and method"""
+	# Refunded payments stay in revenue and their negative refund rows are
+	# counted under the payment type they refund
+	rows = frappe.db.sql("""
+		SELECT p.payment_date,
+			IF(p.payment_type = 'Refund', IFNULL(original.payment_type, p.payment_type), p.payment_type) as payment_type,
+			p.payment_method,
+			SUM(p.amount) as amount,
+			COUNT(*) as payment_count
+		FROM `tabDojo Payment` p
+		LEFT JOIN `tabDojo Payment` original
+			ON p.payment_type = 'Refund'
+			AND p.reference_doctype = 'Dojo Payment'
+			AND original.name = p.reference_name
+		WHERE p.payment_date BETWEEN %s AND %s
+			AND p.docstatus = 1
+			AND p.status IN ('Completed', 'Refunded')
+		GROUP BY 1, 2, 3
+	""", (from_date, to_date), as_dict=True)
+	
+	breakdown = {}
+	for row in rows:
+		breakdown.setdefault(getdate(row.payment_date), []).append(row)
+	
+	return breakdown
+
+
+def get_revenue_totals(breakdown):
+	"""Sum a day's revenue breakdown into rollup totals"""
+	return {
+		"total_revenue": sum(flt(row.amount) for row in breakdown),
+		"payment_count": sum(row.payment_count for row in breakdown)
+	}
+
+
+def refresh_for_doc(doc, method=None, *args, **kwargs):
+	"""doc_events handler that refreshes the rollup days a write touched"""
+	date_fields, section = SOURCE_DOCTYPES[doc.doctype]
+	
+	# Members are saved often; only a join or cancellation date change moves the rollup
+	if doc.doctype == "Dojo Member" and method != "after_delete" and not any(
+		doc.has_value_changed(date_field) for date_field in date_fields):
+		return
+	
+	previous = doc.get_doc_before_save()
+	dates = set()
+	for date_field in date_fields:
+		dates.add(doc.get(date_field))
+		if previous:
+			dates.add(previous.get(date_field))
+	
+	for metric_date in dates:
+		update_daily_metrics(metric_date, (section,))
+
+
+def rebuild_daily_metrics(from_date=None, to_date=None):
+	"""Rebuild the rollup for a date range with one grouped query per section"""
+	from_date = getdate(from_date or get_earliest_source_date())
+	to_date = getdate(to_date or today())
+	
+	empty = {
+		"total_revenue": 0,
+		"payment_count": 0,
+		"new_members": 0,
+		"cancellations": 0,
+		"attendance_count": 0,
+		"check_ins": 0,
+		"promotions": 0
+	}
+	
+	# Start from existing rows so days whose sources disappeared are zeroed
+	days = {
+		getdate(metric_date): dict(empty)
+		for metric_date in frappe.get_all("Dojo Daily Metrics",
+			filters={"metric_date": ["between", [from_date, to_date]]},
+			pluck="metric_date"
+		)
+	}
+	
+	breakdown = get_revenue_breakdown(from_date, to_date)
+	for metric_date, rows in breakdown.items():
+		days.setdefault(metric_date, dict(empty)).update(get_revenue_totals(rows))
+	
+	for row in frappe.db.sql("""
+		SELECT join_date as metric_date, COUNT(*) as new_members
+		FROM `tabDojo Member`
+		WHERE join_date BETWEEN %s AND %s
+		GROUP BY join_date
+	""", (from_date, to_date), as_dict=True):
+		days.setdefault(getdate(row.metric_date), dict(empty))["new_members"] = row.new_members
+	
+	for row in frappe.db.sql("""
+		SELECT cancellation_date as metric_date, COUNT(*) as cancellations
+		FROM `tabDojo Member`
+		WHERE cancellation_date BETWEEN %s AND %s
+		GROUP BY cancellation_date
+	""", (from_date, to_date), as_dict=True):
+		days.setdefault(getdate(row.metric_date), dict(empty))["cancellations"] = row.cancellations
+	
+	for row in frappe.db.sql("""
+		SELECT class_date as metric_date,
+			COUNT(*) as attendance_count,
+			COUNT(CASE WHEN status = 'Present' THEN 1 END) as check_ins
+		FROM `tabClass Attendance`
+		WHERE class_date BETWEEN %s AND %s
+		GROUP BY class_date
+	""", (from_date, to_date), as_dict=True):
+		days.setdefault(getdate(row.metric_date), dict(empty)).update({
+			"attendance_count": row.attendance_count,
+			"check_ins": row.check_ins
+		})
+	
+	update_attendance_facts(from_date, to_date)
+	
+	for row in frappe.db.sql("""
+		SELECT promotion_date as metric_date, COUNT(*) as promotions
+		FROM `tabBelt Promotion`
+		WHERE promotion_date BETWEEN %s AND %s
+			AND docstatus = 1
+		GROUP BY promotion_date
+	""", (from_date, to_date), as_dict=True):
+		days.setdefault(getdate(row.metric_date), dict(empty))["promotions"] = row.promotions
+	
+	for count, metric_date in enumerate(sorted(days), 1):
+		save_daily_metrics(metric_date, days[metric_date], breakdown.get(metric_date, []))
+		
+		if count % 500 == 0:
+			frappe.db.commit()
+	
+	return len(days)
+
+
+def get_earliest_source_date():
+	"""Get the earliest date any rollup source has data for"""
+	earliest = frappe.db.sql("""
+		SELECT MIN(first_date) FROM (
+			SELECT MIN(payment_date) as first_date FROM `tabDojo Payment`
+			UNION ALL SELECT MIN(join_date) FROM `tabDojo Member`
+			UNION ALL SELECT MIN(class_date) FROM `tabClass Attendance`
+			UNION ALL SELECT MIN(promotion_date) FROM `tabBelt Promotion`
+		) source_dates
+	""")[0][0]
+	
+	return earliest or today()
\ No newline at end of file
@@ -1,47 +1,71 @@
 # Copyright (c) 2024, Dojo Planner and contributors
 # For license information, please see license.txt
 
+import calendar
+import time
+
 import frappe
 from frappe.model.document import Document
-from frappe.utils import today, add_months, flt
+from frappe.utils import today, add_days, add_months, date_diff, flt, getdate
 from datetime import datetime, timedelta
 
+from bjj_dojo.bjj_dojo.cache import cached_aggregate, versioned, invalidate_for_bulk_update, get_cached_member_profiles
+from bjj_dojo.bjj_dojo.doctype.belt_promotion.belt_promotion import get_belt_requirements
+from bjj_dojo.bjj_dojo.doctype.dojo_member_search_token.dojo_member_search_token import sync_search_tokens, delete_search_tokens
+
+
+BELT_ORDER = ["White", "Blue", "Purple", "Brown", "Black", "Coral", "Red"]
+
+# Counters kept on the member by Class Attendance writes
+ATTENDANCE_COUNTER_FIELDS = ("total_classes", "classes_attended", "classes_missed", "attended_30_days", "attended_90_days")
+
 
 class DojoMember(Document):
 	def validate(self):
 		self.validate_email()
 		self.calculate_outstanding_amount()
+		self.load_attendance_counters()
 		self.set_next_payment_due()
+		self.update_payment_status()
+		self.set_eligible_from_date()
+		self.set_cancellation_date()
+		self.birthday_mmdd = get_birthday_key(self.date_of_birth) if self.date_of_birth else None
 		
 	def validate_email(self):
-		"""Validate email format and uniqueness"""
-		if self.email:
-			# Check if email already exists for another member
-			existing = frappe.db.get_value("Dojo Member", 
-				{"email": self.email, "name": ("!=", self.name)}, "name")
-			if existing:
-				frappe.throw(f"Email {self.email} already exists for another member")
+		"""Normalise the email; uniqueness is enforced by the index on email_key"""
+		self.email = (self.email or "").strip() or None
+		self.email_key = self.email.lower() if self.email else None
+	
+	def show_unique_validation_message(self, e):
+		"""Report a duplicate email_key as a readable error instead of a key violation"""
+		if "email_key" in str(e):
+			frappe.throw(f"Email {self.email} already exists for another member", frappe.UniqueValidationError)
+		
+		super().show_unique_validation_message(e)
 	
 	def calculate_outstanding_amount(self):
-		"""Calculate outstanding amount based on payments"""
+		"""Calculate outstanding amount from the member's payment ledger"""
+		# total_paid is kept by payment submit/cancel; re-read it by primary key so a
+		# save from a stale form cannot overwrite the ledger
+		self.total_paid = 0 if self.is_new() else flt(
+			frappe.db.get_value("Dojo Member", self.name, "total_paid"))
+		
 		if not self.monthly_fee:
 			self.outstanding_amount = 0
 			return
-			
-		# Get total payments made
-		total_payments = frappe.db.sql("""
-			SELECT IFNULL(SUM(amount), 0) as total
-			FROM `tabDojo Payment`
-			WHERE member = %s AND docstatus = 1
-		""", self.name)[0][0] or 0
-		
-		self.total_paid = total_payments
 		
 		# Calculate expected payments based on membership duration
 		if self.join_date:
 			months_since_joining = self.get_months_since_joining()
 			expected_total = flt(self.monthly_fee) * months_since_joining
-			self.outstanding_amount = max(0, expected_total - total_payments)
+			self.outstanding_amount = max(0, expected_total - flt(self.total_paid))
+	
+	def load_attendance_counters(self):
+		"""Keep the attendance counters maintained by Class Attendance, not the form's copy"""
+		if self.is_new():
+			self.update(dict.fromkeys(ATTENDANCE_COUNTER_FIELDS, 0))
+		else:
+			self.update(frappe.db.get_value("Dojo Member", self.name, ATTENDANCE_COUNTER_FIELDS, as_dict=True) or {})
 	
 	def get_months_since_joining(self):
 		"""Calculate months since joining"""
@@ -63,6 +87,21 @@ class DojoMember(Document):
 			
 		self.next_payment_due = add_months(self.last_payment_date, 1)
 	
+	def set_eligible_from_date(self):
+		"""Set the date the member meets the minimum time in their current belt"""
+		min_months = get_belt_requirements(self.current_belt).get("min_time_months")
+		belt_start = self.belt_promotion_date or self.join_date
+		
+		# Requirements count months as 30 days, matching get_promotion_eligibility
+		self.eligible_from_date = add_days(belt_start, min_months * 30) if min_months and belt_start else None
+	
+	def set_cancellation_date(self):
+		"""Record when the member stopped being Active, for the member growth rollup"""
+		if self.status == "Active":
+			self.cancellation_date = None
+		elif not self.cancellation_date:
+			self.cancellation_date = today()
+	
 	def update_payment_status(self):
 		"""Update payment status based on outstanding amount and due date"""
 		if not self.next_payment_due:
@@ -71,7 +110,7 @@ class DojoMember(Document):
 		today_date = datetime.strptime(today(), '%Y-%m-%d')
 		due_date = datetime.strptime(str(self.next_payment_due), '%Y-%m-%d')
 		
-		if self.outstanding_amount <= 0:
+		if flt(self.outstanding_amount) <= 0:
 			self.payment_status = "Paid"
 		elif today_date > due_date:
 			self.payment_status = "Overdue"
@@ -81,26 +120,14 @@ class DojoMember(Document):
 			self.payment_status = "Paid"
 	
 	def on_update(self):
-		"""Called after document is updated"""
-		self.update_payment_status()
-		
+		sync_search_tokens(self)
+	
+	def on_trash(self):
+		delete_search_tokens(self.name)
+	
 	def get_attendance_stats(self):
 		"""Get member attendance statistics"""
-		stats = frappe.db.sql("""
-			SELECT 
-				COUNT(*) as total_classes,
-				COUNT(CASE WHEN status = 'Present' THEN 1 END) as attended,
-				COUNT(CASE WHEN status = 'Absent' THEN 1 END) as missed
-			FROM `tabClass Attendance`
-			WHERE member = %s
-		""", self.name, as_dict=True)
-		
-		if stats:
-			stat = stats[0]
-			stat['attendance_rate'] = (stat['attended'] / stat['total_classes'] * 100) if stat['total_classes'] > 0 else 0
-			return stat
-		
-		return {'total_classes': 0, 'attended': 0, 'missed': 0, 'attendance_rate': 0}
+		return get_counter_attendance_stats(self)
 	
 	def get_belt_progression_history(self):
 		"""Get belt progression history"""
@@ -136,57 +163,133 @@ class DojoMember(Document):
 @frappe.whitelist()
 def get_member_dashboard_data(member):
 	"""Get dashboard data for a specific member"""
-	member_doc = frappe.get_doc("Dojo Member", member)
+	frappe.has_permission("Dojo Member", "read", member, throw=True)
+	
+	profile = get_cached_member_profiles([member], build_member_profiles).get(member)
+	if not profile:
+		frappe.throw(f"Dojo Member {member} not found", frappe.DoesNotExistError)
+	
+	return profile
+
+
+@frappe.whitelist()
+def get_member_profiles(members):
+	"""Get compact member card profiles for a roster, keyed by member"""
+	frappe.has_permission("Dojo Member", "read", throw=True)
+	
+	members = frappe.parse_json(members) if isinstance(members, str) else members
+	profiles = get_cached_member_profiles(list(members), build_member_profiles)
+	
+	return {member: profiles[member] for member in members if member in profiles}
+
+
+def build_member_profiles(members):
+	"""Build member card profiles with one query per section for all members"""
+	rows = frappe.get_all("Dojo Member",
+		filters={"name": ["in", members]},
+		fields=["name", "member_name", "status", "current_belt", "join_date", "membership_type",
+				"monthly_fee", "payment_status", "outstanding_amount", "total_paid", "next_payment_due"]
+			+ list(ATTENDANCE_COUNTER_FIELDS)
+	)
+	
+	belt_history = {}
+	for promotion in frappe.get_all("Belt Promotion",
+		filters={"member": ["in", members]},
+		fields=["member", "promotion_date", "from_belt", "to_belt", "instructor", "notes"],
+		order_by="promotion_date desc"
+	):
+		belt_history.setdefault(promotion.pop("member"), []).append(promotion)
+	
+	return {
+		row.name: {
+			"member_info": {
+				"name": row.member_name,
+				"status": row.status,
+				"belt": row.current_belt,
+				"join_date": row.join_date,
+				"membership_type": row.membership_type
+			},
+			"payment_info": {
+				"monthly_fee": row.monthly_fee,
+				"payment_status": row.payment_status,
+				"outstanding_amount": row.outstanding_amount,
+				"total_paid": row.total_paid,
+				"next_payment_due": row.next_payment_due
+			},
+			"attendance_stats": get_counter_attendance_stats(row),
+			"belt_history": belt_history.get(row.name, [])
+		}
+		for row in rows
+	}
+
+
+def get_attendance_stats(members):
+	"""Get attendance totals and rate per member from the maintained counters"""
+	rows = frappe.get_all("Dojo Member",
+		filters={"name": ["in", members]},
+		fields=["name"] + list(ATTENDANCE_COUNTER_FIELDS)
+	)
+	
+	return {row.name: get_counter_attendance_stats(row) for row in rows}
+
+
+def get_counter_attendance_stats(member):
+	"""Build attendance stats from a member's counter fields"""
+	total_classes = member.total_classes or 0
+	attended = member.classes_attended or 0
 	
 	return {
-		"member_info": {
-			"name": member_doc.member_name,
-			"status": member_doc.status,
-			"belt": member_doc.current_belt,
-			"join_date": member_doc.join_date,
-			"membership_type": member_doc.membership_type
-		},
-		"payment_info": {
-			"monthly_fee": member_doc.monthly_fee,
-			"payment_status": member_doc.payment_status,
-			"outstanding_amount": member_doc.outstanding_amount,
-			"total_paid": member_doc.total_paid,
-			"next_payment_due": member_doc.next_payment_due
-		},
-		"attendance_stats": member_doc.get_attendance_stats(),
-		"belt_history": member_doc.get_belt_progression_history()
+		'total_classes': total_classes,
+		'attended': attended,
+		'missed': member.classes_missed or 0,
+		'attended_30_days': member.attended_30_days or 0,
+		'attended_90_days': member.attended_90_days or 0,
+		'attendance_rate': (attended / total_classes * 100) if total_classes > 0 else 0
 	}
 
 
 @frappe.whitelist()
+@versioned("get_members_summary")
+@cached_aggregate("get_members_summary")
 def get_members_summary():
 	"""Get summary statistics for all members"""
-	total_members = frappe.db.count("Dojo Member")
-	active_members = frappe.db.count("Dojo Member", {"status": "Active"})
-	
-	# Belt distribution
-	belt_distribution = frappe.db.sql("""
-		SELECT current_belt, COUNT(*) as count
+	# One grouped pass over members; every figure below is derived from it
+	rows = frappe.db.sql("""
+		SELECT status, current_belt, payment_status,
+			COUNT(*) as count,
+			IFNULL(SUM(monthly_fee), 0) as monthly_fee
 		FROM `tabDojo Member`
-		WHERE status = 'Active'
-		GROUP BY current_belt
-		ORDER BY FIELD(current_belt, 'White', 'Blue', 'Purple', 'Brown', 'Black', 'Coral', 'Red')
+		GROUP BY status, current_belt, payment_status
 	""", as_dict=True)
 	
-	# Payment status distribution
-	payment_status = frappe.db.sql("""
-		SELECT payment_status, COUNT(*) as count
-		FROM `tabDojo Member`
-		WHERE status = 'Active'
-		GROUP BY payment_status
-	""", as_dict=True)
+	total_members = 0
+	active_members = 0
+	monthly_revenue = 0
+	belt_counts = {}
+	payment_counts = {}
 	
-	# Monthly revenue
-	monthly_revenue = frappe.db.sql("""
-		SELECT IFNULL(SUM(monthly_fee), 0) as total
-		FROM `tabDojo Member`
-		WHERE status = 'Active' AND monthly_fee IS NOT NULL
-	""")[0][0] or 0
+	for row in rows:
+		total_members += row.count
+		if row.status != "Active":
+			continue
+		
+		active_members += row.count
+		monthly_revenue += flt(row.monthly_fee)
+		belt_counts[row.current_belt] = belt_counts.get(row.current_belt, 0) + row.count
+		payment_counts[row.payment_status] = payment_counts.get(row.payment_status, 0) + row.count
+	
+	# Belt distribution
+	belt_distribution = [
+		frappe._dict(current_belt=belt, count=count)
+		for belt, count in sorted(belt_counts.items(),
+			key=lambda item: BELT_ORDER.index(item[0]) if item[0] in BELT_ORDER else -1)
+	]
+	
+	# Payment status distribution
+	payment_status = [
+		frappe._dict(payment_status=status, count=count)
+		for status, count in payment_counts.items()
+	]
 	
 	return {
 		"total_members": total_members,
@@ -194,4 +297,312 @@ def get_members_summary():
 		"belt_distribution": belt_distribution,
 		"payment_status": payment_status,
 		"monthly_revenue": monthly_revenue
-	}
\ No newline at end of file
+	}
+
+
+def on_doctype_update():
+	"""Add composite indexes used by the dashboard lookups and billing runs"""
+	frappe.db.add_index("Dojo Member", ["status", "last_attendance_date"])
+	frappe.db.add_index("Dojo Member", ["status", "eligible_from_date"])
+	frappe.db.add_index("Dojo Member", ["status", "birthday_mmdd"])
+	frappe.db.add_index("Dojo Member", ["status", "next_payment_due"])
+
+
+def get_birthday_key(date):
+	"""Get the MM-DD key stored in birthday_mmdd for a date"""
+	return getdate(date).strftime("%m-%d")
+
+
+def get_birthday_keys(from_date, days=1):
+	"""Get the birthday keys celebrated on each day of a window, in day order"""
+	keys = []
+	for offset in range(days):
+		date = getdate(add_days(from_date, offset))
+		keys.append(get_birthday_key(date))
+		
+		# Leap-day birthdays are celebrated on 28 February in common years
+		if date.month == 2 and date.day == 28 and not calendar.isleap(date.year):
+			keys.append("02-29")
+	
+	return keys
+
+
+def refresh_last_attendance_dates(members=None):
+	"""Recompute last_attendance_date from attendance rows and return the members that drifted"""
+	member_condition = attendance_condition = ""
+	params = {}
+	if members:
+		member_condition = "AND dm.name IN %(members)s"
+		attendance_condition = "AND member IN %(members)s"
+		params["members"] = tuple(members)
+	
+	drifted = frappe.db.sql(f"""
+		SELECT dm.name, dm.last_attendance_date, ca.last_date
+		FROM `tabDojo Member` dm
+		LEFT JOIN (
+			SELECT member, MAX(class_date) as last_date
+			FROM `tabClass Attendance`
+			WHERE status = 'Present'
+				{attendance_condition}
+			GROUP BY member
+		) ca ON ca.member = dm.name
+		WHERE NOT (dm.last_attendance_date <=> ca.last_date)
+			{member_condition}
+	""", params, as_dict=True)
+	
+	if drifted:
+		frappe.db.sql("""
+			UPDATE `tabDojo Member` dm
+			LEFT JOIN (
+				SELECT member, MAX(class_date) as last_date
+				FROM `tabClass Attendance`
+				WHERE status = 'Present'
+					AND member IN %(drifted)s
+				GROUP BY member
+			) ca ON ca.member = dm.name
+			SET dm.last_attendance_date = ca.last_date
+			WHERE dm.name IN %(drifted)s
+		""", {"drifted": tuple(row.name for row in drifted)})
+	
+	return drifted
+
+
+def repair_last_attendance_dates():
+	"""Nightly job: repair last_attendance_date values that drifted from attendance history"""
+	drifted = refresh_last_attendance_dates()
+	
+	if drifted:
+		frappe.logger("bjj_dojo").info(
+			f"Repaired last_attendance_date for {len(drifted)} members")
+
+
+def get_attendance_counts(attendance):
+	"""Get the counter increments one attendance mark contributes"""
+	present = attendance.status == "Present"
+	days_ago = date_diff(today(), attendance.class_date) if attendance.class_date else None
+	
+	return {
+		"total_classes": 1,
+		"classes_attended": int(present),
+		"classes_missed": int(attendance.status == "Absent"),
+		"attended_30_days": int(present and days_ago is not None and days_ago < 30),
+		"attended_90_days": int(present and days_ago is not None and days_ago < 90)
+	}
+
+
+def apply_attendance_counter_deltas(deltas):
+	"""Move members' attendance counters by {member: {counter: delta}} in O(1) per member"""
+	for member, counts in deltas.items():
+		if not member or not any(counts.values()):
+			continue
+		
+		assignments = ", ".join(
+			f"{fieldname} = GREATEST(0, IFNULL({fieldname}, 0) + %({fieldname})s)"
+			for fieldname in ATTENDANCE_COUNTER_FIELDS
+		)
+		frappe.db.sql(f"""
+			UPDATE `tabDojo Member`
+			SET {assignments}
+			WHERE name = %(member)s
+		""", dict(counts, member=member))
+
+
+def rebuild_attendance_counters(members=None):
+	"""Recompute every attendance counter from attendance rows with one set-based update"""
+	# Callers invalidate Dojo Member caches once their transaction commits
+	member_condition = attendance_condition = ""
+	params = {"today": today()}
+	if members:
+		member_condition = "WHERE dm.name IN %(members)s"
+		attendance_condition = "WHERE member IN %(members)s"
+		params["members"] = tuple(members)
+	
+	frappe.db.sql(f"""
+		UPDATE `tabDojo Member` dm
+		LEFT JOIN (
+			SELECT member,
+				COUNT(*) as total_classes,
+				COUNT(CASE WHEN status = 'Present' THEN 1 END) as classes_attended,
+				COUNT(CASE WHEN status = 'Absent' THEN 1 END) as classes_missed,
+				COUNT(CASE WHEN status = 'Present' AND class_date > DATE_SUB(%(today)s, INTERVAL 30 DAY) THEN 1 END) as attended_30_days,
+				COUNT(CASE WHEN status = 'Present' AND class_date > DATE_SUB(%(today)s, INTERVAL 90 DAY) THEN 1 END) as attended_90_days
+			FROM `tabClass Attendance`
+			{attendance_condition}
+			GROUP BY member
+		) ca ON ca.member = dm.name
+		SET {", ".join(f"dm.{fieldname} = IFNULL(ca.{fieldname}, 0)" for fieldname in ATTENDANCE_COUNTER_FIELDS)}
+		{member_condition}
+	""", params)
+
+
+def refresh_rolling_attendance_counts():
+	"""Nightly job: age the 30 and 90 day attended counts as days pass"""
+	# Only members with attendance in the last 90 days, or a count left to clear, can change
+	frappe.db.sql("""
+		UPDATE `tabDojo Member` dm
+		LEFT JOIN (
+			SELECT member,
+				COUNT(CASE WHEN class_date > DATE_SUB(%(today)s, INTERVAL 30 DAY) THEN 1 END) as attended_30_days,
+				COUNT(*) as attended_90_days
+			FROM `tabClass Attendance`
+			WHERE status = 'Present'
+				AND class_date > DATE_SUB(%(today)s, INTERVAL 90 DAY)
+			GROUP BY member
+		) ca ON ca.member = dm.name
+		SET dm.attended_30_days = IFNULL(ca.attended_30_days, 0),
+			dm.attended_90_days = IFNULL(ca.attended_90_days, 0)
+		WHERE ca.member IS NOT NULL OR dm.attended_90_days > 0
+	""", {"today": today()})
+	
+	frappe.db.commit()
+	invalidate_for_bulk_update("Dojo Member")
+
+
+def get_expected_eligible_from_date_sql():
+	"""Build the SQL expression that derives eligible_from_date for a member row"""
+	cases = []
+	for belt in BELT_ORDER:
+		min_months = get_belt_requirements(belt).get("min_time_months")
+		if min_months:
+			cases.append(f"WHEN {frappe.db.escape(belt)} THEN "
+				f"DATE_ADD(COALESCE(belt_promotion_date, join_date), INTERVAL {int(min_months) * 30} DAY)")
+	
+	return f"CASE current_belt {' '.join(cases)} ELSE NULL END"
+
+
+def repair_eligible_from_dates():
+	"""Nightly job: repair eligible_from_date values that drifted from belt and join dates"""
+	expected = get_expected_eligible_from_date_sql()
+	
+	drifted = frappe.db.sql_list(f"""
+		SELECT name
+		FROM `tabDojo Member`
+		WHERE NOT (eligible_from_date <=> {expected})
+	""")
+	
+	if drifted:
+		frappe.db.sql(f"""
+			UPDATE `tabDojo Member`
+			SET eligible_from_date = {expected}
+			WHERE name IN %(drifted)s
+		""", {"drifted": tuple(drifted)})
+		
+		frappe.logger("bjj_dojo").info(
+			f"Repaired eligible_from_date for {len(drifted)} members")
+	
+	return drifted
+
+
+def get_outstanding_amount_sql(total_paid="IFNULL(total_paid, 0)"):
+	"""Build the SQL expression for outstanding_amount, matching calculate_outstanding_amount"""
+	months_since_joining = ("GREATEST(1, (YEAR(%(today)s) - YEAR(join_date)) * 12"
+		" + MONTH(%(today)s) - MONTH(join_date))")
+	
+	return f"""IF(IFNULL(monthly_fee, 0) = 0 OR join_date IS NULL, 0,
+		GREATEST(0, monthly_fee * {months_since_joining} - {total_paid}))"""
+
+
+def apply_payment_to_ledger(member, amount):
+	"""Add a submitted payment (negative when cancelled) to the member's ledger in O(1)"""
+	# outstanding_amount is computed from the new total rather than relying on assignment order
+	frappe.db.sql(f"""
+		UPDATE `tabDojo Member`
+		SET total_paid = IFNULL(total_paid, 0) + %(amount)s,
+			outstanding_amount = {get_outstanding_amount_sql("(IFNULL(total_paid, 0) + %(amount)s)")}
+		WHERE name = %(member)s
+	""", {"member": member, "amount": flt(amount), "today": today()})
+
+
+def reconcile_member_ledgers():
+	"""Nightly job: rebuild every member's ledger from submitted payments and report drift"""
+	payments = """
+		SELECT member, SUM(amount) as total
+		FROM `tabDojo Payment`
+		WHERE docstatus = 1
+		GROUP BY member
+	"""
+	
+	drifted = frappe.db.sql(f"""
+		SELECT m.name, IFNULL(m.total_paid, 0) as total_paid, IFNULL(p.total, 0) as actual
+		FROM `tabDojo Member` m
+		LEFT JOIN ({payments}) p ON p.member = m.name
+		WHERE IFNULL(m.total_paid, 0) != IFNULL(p.total, 0)
+	""", as_dict=True)
+	
+	# Outstanding amounts grow as months pass, so every member is refreshed; multi-table
+	# updates do not guarantee assignment order, so the new total is used directly
+	frappe.db.sql(f"""
+		UPDATE `tabDojo Member` m
+		LEFT JOIN ({payments}) p ON p.member = m.name
+		SET m.total_paid = IFNULL(p.total, 0),
+			m.outstanding_amount = {get_outstanding_amount_sql("IFNULL(p.total, 0)")}
+	""", {"today": today()})
+	
+	frappe.db.commit()
+	invalidate_for_bulk_update("Dojo Member")
+	
+	if drifted:
+		frappe.logger("bjj_dojo").warning(
+			f"Reconciled total_paid for {len(drifted)} members: "
+			+ ", ".join(f"{row.name} ({row.total_paid} -> {row.actual})" for row in drifted[:20]))
+	
+	return drifted
+
+
+def get_payment_status_sql():
+	"""Build the SQL expression for payment_status, matching update_payment_status"""
+	return """CASE
+		WHEN IFNULL(outstanding_amount, 0) <= 0 THEN 'Paid'
+		WHEN %(today)s > next_payment_due THEN 'Overdue'
+		WHEN %(today)s >= DATE_SUB(next_payment_due, INTERVAL 7 DAY) THEN 'Pending'
+		ELSE 'Paid'
+	END"""
+
+
+def refresh_payment_statuses(chunk_size=5000):
+	"""Nightly job: recompute payment_status for active members in keyset-ordered chunks"""
+	started = time.monotonic()
+	expected = get_payment_status_sql()
+	last_name = ""
+	changed = 0
+	
+	while True:
+		chunk = frappe.db.sql_list("""
+			SELECT name
+			FROM `tabDojo Member`
+			WHERE name > %s
+			ORDER BY name
+			LIMIT %s
+		""", (last_name, chunk_size))
+		
+		if not chunk:
+			break
+		
+		params = {"today": today(), "first": chunk[0], "last": chunk[-1]}
+		stale = frappe.db.sql_list(f"""
+			SELECT name
+			FROM `tabDojo Member`
+			WHERE name BETWEEN %(first)s AND %(last)s
+				AND status = 'Active'
+				AND next_payment_due IS NOT NULL
+				AND NOT (payment_status <=> {expected})
+		""", params)
+		
+		if stale:
+			frappe.db.sql(f"""
+				UPDATE `tabDojo Member`
+				SET payment_status = {expected}
+				WHERE name IN %(stale)s
+			""", dict(params, stale=tuple(stale)))
+			changed += len(stale)
+		
+		frappe.db.commit()
+		last_name = chunk[-1]
+	
+	if changed:
+		invalidate_for_bulk_update("Dojo Member")
+	
+	frappe.logger("bjj_dojo").info(
+		f"Refreshed payment status in {time.monotonic() - started:.2f}s: {changed} members changed")
+	
+	return changed
\ No newline at end of file
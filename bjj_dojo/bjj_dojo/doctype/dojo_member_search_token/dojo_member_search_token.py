@@ -0,0 +1,131 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import re
+import unicodedata
+
+import frappe
+from frappe.model.document import Document
+
+
+# Member fields whose changes require the member's tokens to be rebuilt
+TOKEN_SOURCE_FIELDS = ("member_name", "email", "phone")
+
+# Emails, digit runs with phone separators, and words (hyphenated IDs stay whole)
+SEARCH_TERM_PATTERN = re.compile(r"\S+@\S+|[+(]?\d[\d\s().-]*\d|[^\W\d_][\w'-]*|\d")
+
+
+class DojoMemberSearchToken(Document):
+	pass
+
+
+def on_doctype_update():
+	"""Index tokens for prefix range scans that resolve straight to members"""
+	frappe.db.add_index("Dojo Member Search Token", ["token", "member"])
+
+
+def normalize_words(text):
+	"""Split text into lowercase, accent-free words"""
+	text = unicodedata.normalize("NFKD", text or "")
+	text = "".join(char for char in text if not unicodedata.combining(char))
+	
+	# Apostrophes join rather than split names such as O'Brien
+	text = text.lower().replace("'", "")
+	return [word for word in re.split(r"[^a-z0-9]+", text) if word]
+
+
+def get_digits(text):
+	"""Strip everything but digits from a phone number or ID"""
+	return re.sub(r"\D", "", text or "")
+
+
+def get_search_terms(text):
+	"""Normalise typed text or a stored value into search terms, the same way for both"""
+	terms = []
+	for part in SEARCH_TERM_PATTERN.findall(text or ""):
+		if "@" in part:
+			terms.append(part.lower())
+		elif part[0].isdigit() or part[0] in "+(":
+			terms.append(get_digits(part))
+		elif any(char.isdigit() for char in part):
+			# Member IDs such as MEM-2026-00012 are matched as one term
+			terms.append(part.lower())
+		else:
+			terms.extend(normalize_words(part))
+	
+	return [term for term in terms if term]
+
+
+def get_member_tokens(member):
+	"""Get the (token, token_type) pairs a member can be found by"""
+	tokens = {(term, "Name") for term in get_search_terms(member.member_name)}
+	tokens.update((term, "Email") for term in get_search_terms(member.email))
+	
+	# Front desks type phone numbers from the start or ask for the last four digits
+	for phone in get_search_terms(member.phone):
+		tokens.add((phone, "Phone"))
+		tokens.add((phone[-4:], "Phone"))
+	
+	# IDs are found whole, by their padded sequence or by the bare number
+	tokens.add((member.name.lower(), "ID"))
+	sequence = get_digits(member.name.rsplit("-", 1)[-1])
+	if sequence:
+		tokens.add((sequence, "ID"))
+		if sequence.lstrip("0"):
+			tokens.add((sequence.lstrip("0"), "ID"))
+	
+	return tokens
+
+
+def sync_search_tokens(member):
+	"""Replace a member's tokens when a searchable field changed"""
+	if not any(member.has_value_changed(fieldname) for fieldname in TOKEN_SOURCE_FIELDS):
+		return
+	
+	frappe.db.delete("Dojo Member Search Token", {"member": member.name})
+	insert_search_tokens([member])
+
+
+def delete_search_tokens(member):
+	"""Drop a member's tokens"""
+	frappe.db.delete("Dojo Member Search Token", {"member": member})
+
+
+def insert_search_tokens(members):
+	"""Insert the tokens for several members with one multi-row insert"""
+	rows = [
+		(frappe.generate_hash(length=12), token, token_type, member.name)
+		for member in members
+		for token, token_type in get_member_tokens(member)
+	]
+	
+	if rows:
+		frappe.db.bulk_insert("Dojo Member Search Token",
+			fields=["name", "token", "token_type", "member"], values=rows)
+
+
+def rebuild_search_tokens(chunk_size=2000):
+	"""Rebuild every member's tokens, walking members in keyset-ordered chunks"""
+	frappe.db.delete("Dojo Member Search Token")
+	
+	last_name = ""
+	count = 0
+	
+	while True:
+		members = frappe.get_all("Dojo Member",
+			filters={"name": [">", last_name]},
+			fields=["name", "member_name", "email", "phone"],
+			order_by="name",
+			limit=chunk_size
+		)
+		
+		if not members:
+			break
+		
+		insert_search_tokens(members)
+		frappe.db.commit()
+		
+		count += len(members)
+		last_name = members[-1].name
+	
+	return count
\ No newline at end of file
@@ -5,6 +5,9 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt, today, add_months
 
+from bjj_dojo.bjj_dojo.cache import cached_aggregate, versioned
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import apply_payment_to_ledger
+
 
 class DojoPayment(Document):
 	def validate(self):
@@ -18,10 +21,14 @@ class DojoPayment(Document):
 	
 	def validate_amount(self):
 		"""Validate payment amount"""
-		if flt(self.amount) <= 0:
+		# Refunds are recorded as negative amounts against the original payment
+		if self.payment_type == "Refund":
+			if flt(self.amount) >= 0:
+				frappe.throw("Refund amount must be negative")
+		elif flt(self.amount) <= 0:
 			frappe.throw("Payment amount must be greater than zero")
 		
-		if flt(self.processing_fee or 0) >= flt(self.amount):
+		if flt(self.processing_fee or 0) >= abs(flt(self.amount)):
 			frappe.throw("Processing fee cannot be greater than or equal to payment amount")
 	
 	def set_receipt_number(self):
@@ -31,15 +38,26 @@ class DojoPayment(Document):
 			count = frappe.db.count("Dojo Payment", {"status": "Completed"}) + 1
 			self.receipt_number = f"RCP-{count:06d}"
 	
+	def before_submit(self):
+		"""Mark the payment Completed before the submitted row is written"""
+		# Billing runs insert Pending drafts; setting this in on_submit would never be saved
+		self.status = "Completed"
+		self.set_receipt_number()
+	
 	def on_submit(self):
 		"""Called when payment is submitted"""
-		self.status = "Completed"
+		# Ledger first: the member save below derives outstanding_amount from it
+		apply_payment_to_ledger(self.member, self.amount)
 		self.update_member_payment_info()
 		self.create_accounting_entries()
 	
+	def before_cancel(self):
+		"""Mark the payment Cancelled before the cancelled row is written"""
+		self.status = "Cancelled"
+	
 	def on_cancel(self):
 		"""Called when payment is cancelled"""
-		self.status = "Cancelled"
+		apply_payment_to_ledger(self.member, -flt(self.amount))
 		self.update_member_payment_info()
 	
 	def update_member_payment_info(self):
@@ -201,6 +219,15 @@ class DojoPayment(Document):
 		return "PDF receipt content would be generated here"
 
 
+def on_doctype_update():
+	"""Add a composite index for per-member payment history lookups"""
+	frappe.db.add_index("Dojo Payment", ["member", "docstatus", "payment_date"])
+	
+	# A member is billed at most once per billing period and payment type
+	frappe.db.add_unique("Dojo Payment", ["member", "billing_period", "payment_type"],
+		constraint_name="unique_member_billing_period")
+
+
 @frappe.whitelist()
 def create_membership_payment(member, payment_type, amount, payment_method="Cash"):
 	"""Create a membership payment"""
@@ -225,56 +252,29 @@ def create_membership_payment(member, payment_type, amount, payment_method="Cash
 
 
 @frappe.whitelist()
+@versioned("get_payment_summary")
+@cached_aggregate("get_payment_summary")
 def get_payment_summary(start_date=None, end_date=None):
 	"""Get payment summary for dashboard"""
-	conditions = []
-	params = []
-	
-	if start_date:
-		conditions.append("payment_date >= %s")
-		params.append(start_date)
+	conditions, params = get_metric_date_conditions(start_date, end_date)
 	
-	if end_date:
-		conditions.append("payment_date <= %s")
-		params.append(end_date)
+	# Revenue by payment type and method, read from the daily rollup
+	revenue_breakdown = frappe.db.sql(f"""
+		SELECT r.payment_type, r.payment_method, SUM(r.amount) as total, SUM(r.payment_count) as count
+		FROM `tabDojo Daily Revenue` r
+		JOIN `tabDojo Daily Metrics` m ON r.parent = m.name AND r.parenttype = 'Dojo Daily Metrics'
+		{conditions}
+		GROUP BY r.payment_type, r.payment_method
+	""", params, as_dict=True)
 	
-	where_clause = "WHERE docstatus = 1 AND status = 'Completed'"
-	if conditions:
-		where_clause += " AND " + " AND ".join(conditions)
+	revenue_by_type = group_revenue(revenue_breakdown, "payment_type")
+	revenue_by_method = group_revenue(revenue_breakdown, "payment_method")
 	
 	# Total revenue
-	total_revenue = frappe.db.sql(f"""
-		SELECT IFNULL(SUM(amount), 0) as total
-		FROM `tabDojo Payment`
-		{where_clause}
-	""", params)[0][0] or 0
-	
-	# Revenue by payment type
-	revenue_by_type = frappe.db.sql(f"""
-		SELECT payment_type, SUM(amount) as total, COUNT(*) as count
-		FROM `tabDojo Payment`
-		{where_clause}
-		GROUP BY payment_type
-		ORDER BY total DESC
-	""", params, as_dict=True)
-	
-	# Revenue by payment method
-	revenue_by_method = frappe.db.sql(f"""
-		SELECT payment_method, SUM(amount) as total, COUNT(*) as count
-		FROM `tabDojo Payment`
-		{where_clause}
-		GROUP BY payment_method
-		ORDER BY total DESC
-	""", params, as_dict=True)
+	total_revenue = sum(flt(row.total) for row in revenue_by_type)
 	
 	# Daily revenue trend
-	daily_revenue = frappe.db.sql(f"""
-		SELECT payment_date, SUM(amount) as total, COUNT(*) as count
-		FROM `tabDojo Payment`
-		{where_clause}
-		GROUP BY payment_date
-		ORDER BY payment_date
-	""", params, as_dict=True)
+	daily_revenue = get_daily_revenue(start_date, end_date)
 	
 	return {
 		"total_revenue": total_revenue,
@@ -284,6 +284,49 @@ def get_payment_summary(start_date=None, end_date=None):
 	}
 
 
+def get_metric_date_conditions(start_date=None, end_date=None):
+	"""Build a WHERE clause on the daily rollup's metric date"""
+	conditions = []
+	params = []
+	
+	if start_date:
+		conditions.append("m.metric_date >= %s")
+		params.append(start_date)
+	
+	if end_date:
+		conditions.append("m.metric_date <= %s")
+		params.append(end_date)
+	
+	where_clause = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+	return where_clause, params
+
+
+def group_revenue(revenue_breakdown, fieldname):
+	"""Collapse the type/method breakdown onto one of its dimensions"""
+	grouped = {}
+	for row in revenue_breakdown:
+		key = row.get(fieldname)
+		if key not in grouped:
+			grouped[key] = frappe._dict({fieldname: key, "total": 0, "count": 0})
+		grouped[key].total += flt(row.total)
+		grouped[key].count += row.count
+	
+	return sorted(grouped.values(), key=lambda row: row.total, reverse=True)
+
+
+def get_daily_revenue(start_date=None, end_date=None):
+	"""Get completed revenue per payment date"""
+	conditions, params = get_metric_date_conditions(start_date, end_date)
+	conditions += (" AND " if conditions else "WHERE ") + "m.payment_count > 0"
+	
+	return frappe.db.sql(f"""
+		SELECT m.metric_date as payment_date, m.total_revenue as total, m.payment_count as count
+		FROM `tabDojo Daily Metrics` m
+		{conditions}
+		ORDER BY m.metric_date
+	""", params, as_dict=True)
+
+
 @frappe.whitelist()
 def get_member_payment_history(member, limit=50):
 	"""Get payment history for a member"""
@@ -325,7 +368,8 @@ def process_refund(payment_name, refund_amount, reason):
 	refund_doc.insert()
 	refund_doc.submit()
 	
-	# Update original payment status if fully refunded
+	# Update original payment status if fully refunded; revenue already nets the
+	# refund row against it, so the rollup is unaffected
 	if flt(refund_amount) == flt(payment_doc.amount):
 		frappe.db.set_value("Dojo Payment", payment_name, "status", "Refunded")
 	
@@ -0,0 +1,23 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.naming import parse_naming_series
+from frappe.utils import cint
+
+
+def reserve_series_names(naming_series, count):
+	"""Reserve a block of names from a naming series with one counter update"""
+	prefix = parse_naming_series(naming_series)
+	
+	# Lock the counter row so concurrent inserts take names after the reserved block
+	current = frappe.db.sql("SELECT current FROM `tabSeries` WHERE name = %s FOR UPDATE", prefix)
+	if current:
+		start = cint(current[0][0])
+		frappe.db.sql("UPDATE `tabSeries` SET current = %s WHERE name = %s", (start + count, prefix))
+	else:
+		start = 0
+		frappe.db.sql("INSERT INTO `tabSeries` (name, current) VALUES (%s, %s)", (prefix, count))
+	
+	# Matches the five-digit counter Frappe appends to naming series without hashes
+	return [f"{prefix}{number:05d}" for number in range(start + 1, start + count + 1)]
\ No newline at end of file
@@ -15,6 +15,7 @@ class DojoDashboard {
 		this.setup_dashboard();
 		this.load_data();
 		this.setup_event_listeners();
+		this.setup_realtime();
 	}
 
 	setup_dashboard() {
@@ -29,29 +30,25 @@ class DojoDashboard {
 		// Initialize earnings chart
 		const earningsCtx = document.getElementById('earnings-chart');
 		if (earningsCtx) {
+			// One stacked area per payment type, plus a dashed line for the compared period
 			this.earnings_chart = new Chart(earningsCtx, {
 				type: 'line',
 				data: {
 					labels: [],
-					datasets: [{
-						label: 'Earnings',
-						data: [],
-						borderColor: '#007bff',
-						backgroundColor: 'rgba(0, 123, 255, 0.1)',
-						tension: 0.4,
-						fill: true
-					}]
+					datasets: []
 				},
 				options: {
 					responsive: true,
 					maintainAspectRatio: false,
 					plugins: {
 						legend: {
-							display: false
+							display: true,
+							position: 'bottom'
 						}
 					},
 					scales: {
 						y: {
+							stacked: true,
 							beginAtZero: true,
 							grid: {
 								display: false
@@ -89,6 +86,19 @@ class DojoDashboard {
 					plugins: {
 						legend: {
 							display: false
+						},
+						tooltip: {
+							callbacks: {
+								footer: (items) => {
+									const bucket = this.member_growth && this.member_growth.series[items[0].dataIndex];
+									if (!bucket) return '';
+									return [
+										`Joined: ${bucket.joins}`,
+										`Cancelled: ${bucket.cancellations}`,
+										`Net growth: ${bucket.net_growth}`
+									];
+								}
+							}
 						}
 					},
 					scales: {
@@ -123,139 +133,269 @@ class DojoDashboard {
 		});
 
 		// Period selectors
-		$(document).on('change', '#earnings-period', (e) => {
-			this.load_earnings_data(e.target.value);
+		$(document).on('change', '#earnings-period, #earnings-compare', () => {
+			this.load_earnings_data();
 		});
 
 		$(document).on('change', '#members-period', (e) => {
 			this.load_members_data(e.target.value);
 		});
 
-		// Refresh data every 5 minutes
+		// Poll only while the realtime socket is down; pushed deltas cover the rest
 		setInterval(() => {
-			this.load_data();
+			if (!this.is_realtime_connected()) {
+				this.load_data();
+			}
 		}, 300000);
 	}
 
-	load_data() {
-		this.load_summary_stats();
-		this.load_earnings_data('1year');
-		this.load_members_data('6months');
-		this.load_recommendations();
-		this.load_recent_activity();
+	setup_realtime() {
+		// Deltas are only published to the Dojo Member room, which checks read permission
+		frappe.realtime.doctype_subscribe('Dojo Member');
+		frappe.realtime.on('dojo_dashboard_update', (data) => {
+			this.apply_update(data);
+		});
+
+		// Deltas published while disconnected are lost, so resync on reconnect
+		if (frappe.realtime.socket) {
+			frappe.realtime.socket.io.on('reconnect', () => {
+				frappe.realtime.doctype_subscribe('Dojo Member');
+				this.load_data();
+			});
+		}
 	}
 
-	load_summary_stats() {
-		frappe.call({
-			method: 'bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.get_members_summary',
-			callback: (r) => {
-				if (r.message) {
-					const data = r.message;
-					$('#total-members').text(data.active_members);
-					$('#active-members-count').text(data.active_members);
-					$('#monthly-revenue').text(frappe.format(data.monthly_revenue, {fieldtype: 'Currency'}));
-				}
-			}
-		});
+	is_realtime_connected() {
+		return frappe.realtime.socket && frappe.realtime.socket.connected;
+	}
 
-		// Load classes today count
+	load_data() {
+		// All widgets come from one server round trip
 		frappe.call({
-			method: 'bjj_dojo.bjj_dojo.doctype.dojo_class.dojo_class.get_weekly_schedule',
+			method: 'bjj_dojo.bjj_dojo.api.dashboard.get_dashboard_snapshot',
 			args: {
-				start_date: frappe.datetime.get_today()
+				earnings_period: $('#earnings-period').val() || '1year',
+				earnings_compare: $('#earnings-compare').val() || 'previous_year',
+				members_period: $('#members-period').val() || '6months',
+				version: this.snapshot_version || ''
 			},
 			callback: (r) => {
-				if (r.message) {
-					const today = frappe.datetime.get_today();
-					const todayClasses = r.message[today] || [];
-					$('#classes-today-count').text(todayClasses.length);
+				// Unchanged since the last fetch: the server skipped every query
+				if (r.message && !r.message.not_modified) {
+					this.snapshot_version = r.message.version;
+					this.render_snapshot(r.message.data);
 				}
 			}
 		});
+	}
 
-		// Load belt promotions this month
-		const startOfMonth = frappe.datetime.month_start();
-		frappe.call({
-			method: 'frappe.client.get_count',
-			args: {
-				doctype: 'Belt Promotion',
-				filters: {
-					promotion_date: ['>=', startOfMonth]
+	render_snapshot(data) {
+		const members = data.members || {};
+		this.stats = {
+			active_members: members.active_members || 0,
+			monthly_revenue: members.monthly_revenue || 0,
+			classes_today: data.classes_today || 0,
+			check_ins_today: data.check_ins_today || 0,
+			promotions_this_month: data.promotions_this_month || 0
+		};
+		this.activities = data.recent_activity || [];
+
+		this.render_summary_stats();
+		this.render_earnings(data.earnings);
+		this.render_member_growth(data.member_growth);
+		this.render_recommendations(data.recommendations || []);
+		this.render_recent_activity(this.activities);
+	}
+
+	render_summary_stats() {
+		$('#total-members').text(this.stats.active_members);
+		$('#active-members-count').text(this.stats.active_members);
+		$('#monthly-revenue').text(frappe.format(this.stats.monthly_revenue, {fieldtype: 'Currency'}));
+		$('#classes-today-count').text(this.stats.classes_today);
+		$('#check-ins-today-count').text(this.stats.check_ins_today);
+		$('#belt-promotions').text(this.stats.promotions_this_month);
+	}
+
+	apply_update(data) {
+		// Deltas only make sense on top of a loaded snapshot
+		if (!this.stats) return;
+
+		switch (data.event) {
+			case 'check_in':
+				if (data.class_date === frappe.datetime.get_today()) {
+					this.stats.check_ins_today += data.delta;
 				}
-			},
-			callback: (r) => {
-				if (r.message !== undefined) {
-					$('#belt-promotions').text(r.message);
+				break;
+			case 'payment':
+				this.apply_payment(data);
+				break;
+			case 'promotion':
+				if (data.promotion_date >= frappe.datetime.month_start()) {
+					this.stats.promotions_this_month += data.delta;
+				}
+				if (data.delta > 0) {
+					this.push_activity({
+						member: data.member,
+						member_name: data.member_name,
+						description: `was promoted to ${data.to_belt} belt`,
+						date: data.promotion_date,
+						type: 'promotion'
+					});
 				}
+				break;
+			case 'member_status': {
+				const delta = (data.to_status === 'Active') - (data.from_status === 'Active');
+				this.stats.active_members += delta;
+				this.stats.monthly_revenue += delta * flt(data.monthly_fee);
+				this.apply_member_growth(delta);
+				if (data.to_status === 'Inactive') {
+					this.push_activity({
+						member: data.member,
+						member_name: data.member_name,
+						description: `cancelled their membership and it is expiring ${data.next_payment_due || 'soon'}`,
+						date: frappe.datetime.get_today(),
+						type: 'cancellation'
+					});
+				}
+				break;
 			}
-		});
+		}
+
+		this.render_summary_stats();
 	}
 
-	load_earnings_data(period) {
-		let start_date = this.get_period_start_date(period);
-		
-		frappe.call({
-			method: 'bjj_dojo.bjj_dojo.doctype.dojo_payment.dojo_payment.get_payment_summary',
-			args: {
-				start_date: start_date,
-				end_date: frappe.datetime.get_today()
-			},
-			callback: (r) => {
-				if (r.message) {
-					const data = r.message;
-					$('#total-earnings').text(frappe.format(data.total_revenue, {fieldtype: 'Currency'}));
-					
-					// Update chart
-					if (this.earnings_chart && data.daily_revenue) {
-						const labels = data.daily_revenue.map(d => frappe.datetime.str_to_user(d.payment_date));
-						const values = data.daily_revenue.map(d => d.total);
-						
-						this.earnings_chart.data.labels = labels;
-						this.earnings_chart.data.datasets[0].data = values;
-						this.earnings_chart.update();
-					}
-				}
+	apply_payment(data) {
+		const earnings = this.earnings;
+		const current = earnings && earnings.current;
+
+		// Payments outside the plotted window only affect the activity feed
+		const bucket = earnings && earnings.granularity === 'month'
+			? `${data.payment_date.slice(0, 8)}01` : data.payment_date;
+		const index = current ? current.buckets.indexOf(bucket) : -1;
+
+		if (index !== -1) {
+			if (!current.series[data.payment_type]) {
+				earnings.payment_types.push(data.payment_type);
+				['current', 'prior'].forEach(key => {
+					earnings[key].series[data.payment_type] = earnings[key].buckets.map(() => 0);
+				});
 			}
-		});
+
+			current.series[data.payment_type][index] += data.amount;
+			current.total[index] += data.amount;
+			current.total_revenue = flt(current.total_revenue) + data.amount;
+			this.render_earnings(earnings);
+		}
+
+		if (data.delta > 0 && data.amount > 0) {
+			this.push_activity({
+				member: data.member,
+				member_name: data.member_name,
+				description: `has been charged ${format_currency(data.amount)} for ${data.payment_type.toLowerCase()}`,
+				date: data.payment_date,
+				type: 'payment'
+			});
+		}
 	}
 
-	load_members_data(period) {
-		// This would load member growth data over time
-		// For now, we'll simulate the data
-		const labels = this.get_period_labels(period);
-		const data = this.generate_member_growth_data(labels.length);
-		
-		if (this.members_chart) {
-			this.members_chart.data.labels = labels;
-			this.members_chart.data.datasets[0].data = data;
-			this.members_chart.update();
+	apply_member_growth(delta) {
+		const series = this.member_growth && this.member_growth.series;
+		if (!delta || !series || !series.length) return;
+
+		// Status changes land in the current (last) bucket
+		const bucket = series[series.length - 1];
+		if (delta > 0) {
+			bucket.joins += delta;
+		} else {
+			bucket.cancellations -= delta;
 		}
+		bucket.net_growth += delta;
+		bucket.active_members += delta;
+		this.render_member_growth(this.member_growth);
 	}
 
-	load_recommendations() {
-		// Load recommended actions
+	push_activity(activity) {
+		activity.avatar = '/assets/bjj_dojo/images/avatar-placeholder.png';
+		this.activities = [activity].concat(this.activities || []).slice(0, 5);
+		this.render_recent_activity(this.activities);
+	}
+
+	load_earnings_data() {
 		frappe.call({
-			method: 'bjj_dojo.api.dashboard.get_recommendations',
+			method: 'bjj_dojo.bjj_dojo.api.dashboard.get_earnings_trend',
+			args: {
+				period: $('#earnings-period').val() || '1year',
+				compare: $('#earnings-compare').val() || 'previous_year'
+			},
 			callback: (r) => {
 				if (r.message) {
-					this.render_recommendations(r.message);
+					this.render_earnings(r.message);
 				}
 			}
 		});
 	}
 
-	load_recent_activity() {
-		// Load recent member activity
+	render_earnings(data) {
+		if (!data) return;
+
+		this.earnings = data;
+		$('#total-earnings').text(frappe.format(data.current.total_revenue, {fieldtype: 'Currency'}));
+
+		if (!this.earnings_chart) return;
+
+		const colors = ['#007bff', '#28a745', '#ffc107', '#17a2b8', '#6f42c1', '#fd7e14', '#e83e8c', '#20c997'];
+		const label_format = data.granularity === 'month' ? 'MMM YYYY' : 'D MMM';
+
+		const datasets = data.payment_types.map((payment_type, i) => ({
+			label: payment_type,
+			data: data.current.series[payment_type],
+			borderColor: colors[i % colors.length],
+			backgroundColor: colors[i % colors.length] + '33',
+			tension: 0.4,
+			fill: true,
+			stack: 'current'
+		}));
+
+		datasets.push({
+			label: data.compare === 'previous_year' ? 'Previous year' : 'Previous period',
+			data: data.prior.total,
+			borderColor: '#6c757d',
+			borderDash: [4, 4],
+			tension: 0.4,
+			fill: false,
+			stack: 'prior'
+		});
+
+		this.earnings_chart.data.labels = data.current.buckets.map(d => moment(d).format(label_format));
+		this.earnings_chart.data.datasets = datasets;
+		this.earnings_chart.update();
+	}
+
+	load_members_data(period) {
 		frappe.call({
-			method: 'bjj_dojo.api.dashboard.get_recent_activity',
+			method: 'bjj_dojo.bjj_dojo.api.dashboard.get_member_growth_trend',
+			args: {
+				period: period
+			},
 			callback: (r) => {
 				if (r.message) {
-					this.render_recent_activity(r.message);
+					this.render_member_growth(r.message);
 				}
 			}
 		});
 	}
 
+	render_member_growth(data) {
+		if (!data || !this.members_chart) return;
+
+		this.member_growth = data;
+		const label_format = data.granularity === 'month' ? 'MMM YYYY' : 'D MMM';
+
+		this.members_chart.data.labels = data.series.map(d => moment(d.period).format(label_format));
+		this.members_chart.data.datasets[0].data = data.series.map(d => d.active_members);
+		this.members_chart.update();
+	}
+
 	render_recommendations(recommendations) {
 		const container = $('.recommendation-list');
 		container.empty();
@@ -295,59 +435,6 @@ class DojoDashboard {
 			container.append(item);
 		});
 	}
-
-	get_period_start_date(period) {
-		const today = new Date();
-		switch(period) {
-			case '1month':
-				return frappe.datetime.add_months(frappe.datetime.get_today(), -1);
-			case '3months':
-				return frappe.datetime.add_months(frappe.datetime.get_today(), -3);
-			case '6months':
-				return frappe.datetime.add_months(frappe.datetime.get_today(), -6);
-			case '1year':
-			default:
-				return frappe.datetime.add_months(frappe.datetime.get_today(), -12);
-		}
-	}
-
-	get_period_labels(period) {
-		const labels = [];
-		const today = new Date();
-		let months = 6;
-		
-		switch(period) {
-			case '1month':
-				months = 1;
-				break;
-			case '3months':
-				months = 3;
-				break;
-			case '6months':
-				months = 6;
-				break;
-		}
-		
-		for (let i = months; i >= 0; i--) {
-			const date = new Date(today.getFullYear(), today.getMonth() - i, 1);
-			labels.push(date.toLocaleDateString('en-US', { month: 'short', year: 'numeric' }));
-		}
-		
-		return labels;
-	}
-
-	generate_member_growth_data(length) {
-		// Generate sample member growth data
-		const data = [];
-		let baseValue = 450;
-		
-		for (let i = 0; i < length; i++) {
-			baseValue += Math.floor(Math.random() * 20) - 5; // Random growth/decline
-			data.push(Math.max(baseValue, 400)); // Minimum 400 members
-		}
-		
-		return data;
-	}
 }
 
 // Include Chart.js if not already loaded
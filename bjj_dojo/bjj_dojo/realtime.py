@@ -0,0 +1,112 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import flt
+
+
+DASHBOARD_EVENT = "dojo_dashboard_update"
+
+# Deltas carry member names and amounts, so they go to the doctype room that only
+# users who can read members are allowed to join
+DASHBOARD_ROOM_DOCTYPE = "Dojo Member"
+
+
+def publish_dashboard_update(event, **data):
+	"""Push a compact delta to open dashboards once the write commits"""
+	data["event"] = event
+	frappe.publish_realtime(DASHBOARD_EVENT, data, doctype=DASHBOARD_ROOM_DOCTYPE, after_commit=True)
+
+
+def publish_for_doc(doc, method=None, *args, **kwargs):
+	"""doc_events handler that turns a write into a dashboard delta"""
+	handler = DOCTYPE_HANDLERS.get(doc.doctype)
+	if handler:
+		handler(doc, method)
+
+
+def publish_attendance(doc, method):
+	"""Publish check-in deltas when a Present mark is added, moved or withdrawn"""
+	if method == "after_delete":
+		before, after = doc, None
+	else:
+		before, after = doc.get_doc_before_save(), doc
+	
+	was_present = str(before.class_date) if before and before.status == "Present" else None
+	is_present = str(after.class_date) if after and after.status == "Present" else None
+	
+	if was_present == is_present:
+		return
+	
+	for class_date, delta in ((was_present, -1), (is_present, 1)):
+		if class_date:
+			publish_dashboard_update("check_in",
+				class_date=class_date,
+				delta=delta,
+				member=doc.member,
+				member_name=doc.member_name,
+				class_name=doc.class_name
+			)
+
+
+def publish_payment(doc, method):
+	"""Publish revenue deltas when a payment is submitted or cancelled"""
+	delta = -1 if method == "on_cancel" else 1
+	
+	# Only payments that were counted as revenue can leave it
+	previous = doc.get_doc_before_save()
+	if delta < 0 and previous and previous.status not in ("Completed", "Refunded"):
+		return
+	
+	# Refunds count against the revenue type of the payment they refund
+	payment_type = doc.payment_type
+	if payment_type == "Refund" and doc.reference_doctype == "Dojo Payment" and doc.reference_name:
+		payment_type = frappe.db.get_value("Dojo Payment", doc.reference_name, "payment_type") or payment_type
+	
+	publish_dashboard_update("payment",
+		payment_date=str(doc.payment_date),
+		amount=flt(doc.amount) * delta,
+		delta=delta,
+		member=doc.member,
+		member_name=doc.member_name,
+		payment_type=payment_type
+	)
+
+
+def publish_promotion(doc, method):
+	"""Publish promotion deltas when a promotion is submitted or cancelled"""
+	publish_dashboard_update("promotion",
+		promotion_date=str(doc.promotion_date),
+		delta=-1 if method == "on_cancel" else 1,
+		member=doc.member,
+		member_name=doc.member_name,
+		to_belt=doc.to_belt
+	)
+
+
+def publish_member_status(doc, method):
+	"""Publish membership deltas when a member's status changes"""
+	if method == "after_delete":
+		from_status, to_status = doc.status, None
+	elif doc.has_value_changed("status"):
+		previous = doc.get_doc_before_save()
+		from_status, to_status = previous.status if previous else None, doc.status
+	else:
+		return
+	
+	publish_dashboard_update("member_status",
+		from_status=from_status,
+		to_status=to_status,
+		monthly_fee=flt(doc.monthly_fee),
+		member=doc.name,
+		member_name=doc.member_name,
+		next_payment_due=str(doc.next_payment_due or "")
+	)
+
+
+DOCTYPE_HANDLERS = {
+	"Class Attendance": publish_attendance,
+	"Dojo Payment": publish_payment,
+	"Belt Promotion": publish_promotion,
+	"Dojo Member": publish_member_status
+}
\ No newline at end of file
@@ -0,0 +1,178 @@
+# Copyright (c) 2024, Dojo Planner and contributors
+# For license information, please see license.txt
+
+import click
+
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-dojo-metrics")
+@click.option("--from-date", help="First day to rebuild (defaults to the earliest source record)")
+@click.option("--to-date", help="Last day to rebuild (defaults to today)")
+@pass_context
+def rebuild_dojo_metrics(context, from_date=None, to_date=None):
+	"""Backfill the Dojo Daily Metrics rollup from source documents"""
+	import frappe
+	from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import rebuild_daily_metrics
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		days = rebuild_daily_metrics(from_date, to_date)
+		frappe.db.commit()
+		click.echo(f"Rebuilt {days} days of Dojo Daily Metrics")
+	finally:
+		frappe.destroy()
+
+
+@click.command("rebuild-member-search")
+@pass_context
+def rebuild_member_search(context):
+	"""Rebuild the Dojo Member typeahead search tokens"""
+	import frappe
+	from bjj_dojo.bjj_dojo.doctype.dojo_member_search_token.dojo_member_search_token import rebuild_search_tokens
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		members = rebuild_search_tokens()
+		click.echo(f"Rebuilt search tokens for {members} Dojo Members")
+	finally:
+		frappe.destroy()
+
+
+@click.command("import-dojo-members")
+@click.argument("file_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--dry-run", is_flag=True, default=False, help="Validate the file without writing members")
+@click.option("--chunk-size", type=int, default=1000, help="Members written per transaction")
+@click.option("--report", "report_path", help="Write the per-row error report to this CSV file")
+@pass_context
+def import_dojo_members(context, file_path, dry_run=False, chunk_size=1000, report_path=None):
+	"""Import Dojo Members from a CSV or JSONL file"""
+	import csv
+	import frappe
+	from bjj_dojo.bjj_dojo.api.member_import import import_members
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		frappe.set_user("Administrator")
+		report = import_members(file_path, dry_run=dry_run, chunk_size=chunk_size)
+		verb = "Validated" if dry_run else "Imported"
+		click.echo(f"{verb} {report['imported']} of {report['total']} members; {len(report['errors'])} rows rejected")
+		
+		if report_path:
+			with open(report_path, "w", newline="") as f:
+				writer = csv.writer(f)
+				writer.writerow(["row", "member_name", "errors"])
+				for error in report["errors"]:
+					writer.writerow([error["row"], error["member_name"], "; ".join(error["errors"])])
+		else:
+			for error in report["errors"]:
+				click.echo(f"Row {error['row']}: {'; '.join(error['errors'])}")
+	finally:
+		frappe.destroy()
+
+
+@click.command("export-dojo-members")
+@click.option("--dataset", type=click.Choice(["members", "attendance", "payments"]), default="members")
+@click.option("--format", "export_format", type=click.Choice(["csv", "ndjson"]), default="csv")
+@click.option("--status", help="Only members with this status")
+@click.option("--belt", help="Only members with this current belt")
+@click.option("--from-date", help="First day of attendance and payment history")
+@click.option("--to-date", help="Last day of attendance and payment history")
+@click.option("--output", help="File to write (defaults to stdout)")
+@pass_context
+def export_dojo_members(context, dataset="members", export_format="csv", status=None, belt=None,
+	from_date=None, to_date=None, output=None):
+	"""Stream Dojo Members, attendance or payments to CSV or NDJSON"""
+	import sys
+	import frappe
+	from bjj_dojo.bjj_dojo.api.export import write_export
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		file = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+		try:
+			rows = write_export(file, dataset, export_format,
+				status=status, belt=belt, from_date=from_date, to_date=to_date)
+		finally:
+			if output:
+				file.close()
+		
+		click.echo(f"Exported {rows} {dataset} rows", err=True)
+	finally:
+		frappe.destroy()
+
+
+@click.command("rebuild-attendance-counters")
+@click.option("--member", "members", multiple=True, help="Only rebuild these members (repeatable)")
+@pass_context
+def rebuild_attendance_counters(context, members=None):
+	"""Recompute Dojo Member attendance counters from Class Attendance"""
+	import frappe
+	from bjj_dojo.bjj_dojo.cache import invalidate_for_bulk_update
+	from bjj_dojo.bjj_dojo.doctype.dojo_member import dojo_member
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		dojo_member.rebuild_attendance_counters(list(members) or None)
+		frappe.db.commit()
+		invalidate_for_bulk_update("Dojo Member")
+		click.echo("Rebuilt Dojo Member attendance counters")
+	finally:
+		frappe.destroy()
+
+
+@click.command("run-dojo-billing")
+@click.option("--billing-run", help="Resume this Dojo Billing Run instead of starting a new one")
+@click.option("--billing-date", help="Bill members due on or before this date (defaults to today)")
+@click.option("--late-fee", type=float, default=0, help="Late fee charged to overdue members")
+@pass_context
+def run_dojo_billing(context, billing_run=None, billing_date=None, late_fee=0):
+	"""Create Pending dues payments for every member due for billing"""
+	import frappe
+	from bjj_dojo.bjj_dojo.doctype.dojo_billing_run.dojo_billing_run import run_billing
+	
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	
+	try:
+		frappe.set_user("Administrator")
+		if not billing_run:
+			run = frappe.get_doc({
+				"doctype": "Dojo Billing Run",
+				"billing_date": billing_date or frappe.utils.today(),
+				"late_fee": late_fee
+			}).insert()
+			frappe.db.commit()
+			billing_run = run.name
+		
+		run = run_billing(billing_run)
+		click.echo(f"{run.name}: {run.status}, {run.payments_created} payments for "
+			f"{run.members_billed} members totalling {run.total_amount}")
+	finally:
+		frappe.destroy()
+
+
+commands = [
+	rebuild_dojo_metrics,
+	rebuild_member_search,
+	import_dojo_members,
+	export_dojo_members,
+	rebuild_attendance_counters,
+	run_dojo_billing
+]
\ No newline at end of file
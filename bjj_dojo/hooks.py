@@ -95,34 +95,106 @@ before_uninstall = "bjj_dojo.bjj_dojo.install.before_uninstall"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-#	"*": {
-#		"on_update": "method",
-#		"on_cancel": "method",
-#		"on_trash": "method"
-#	}
-# }
+doc_events = {
+	"Dojo Member": {
+		"on_update": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.cache.invalidate_kiosk_member",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		],
+		"on_trash": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.cache.invalidate_kiosk_member"
+		],
+		"after_delete": [
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		],
+		"after_rename": "bjj_dojo.bjj_dojo.cache.invalidate_for_doc"
+	},
+	"Dojo Payment": {
+		"on_update": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc"
+		],
+		"on_submit": "bjj_dojo.bjj_dojo.realtime.publish_for_doc",
+		"on_cancel": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		],
+		"on_update_after_submit": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc"
+		],
+		"on_trash": "bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+		"after_delete": "bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc"
+	},
+	"Class Attendance": {
+		"on_update": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		],
+		"on_trash": "bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+		"after_delete": [
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		]
+	},
+	"Dojo Class": {
+		"on_update": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.cache.invalidate_class_meta",
+			"bjj_dojo.bjj_dojo.doctype.dojo_attendance_fact.dojo_attendance_fact.refresh_for_class"
+		],
+		"on_trash": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.cache.invalidate_class_meta"
+		]
+	},
+	"Belt Promotion": {
+		"on_update": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc"
+		],
+		"on_submit": "bjj_dojo.bjj_dojo.realtime.publish_for_doc",
+		"on_cancel": [
+			"bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+			"bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc",
+			"bjj_dojo.bjj_dojo.realtime.publish_for_doc"
+		],
+		"on_update_after_submit": "bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+		"on_trash": "bjj_dojo.bjj_dojo.cache.invalidate_for_doc",
+		"after_delete": "bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics.refresh_for_doc"
+	}
+}
+
+# Drop cached dashboard aggregates on bench clear-cache
+clear_cache = "bjj_dojo.bjj_dojo.cache.clear_all"
 
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-#	"all": [
-#		"bjj_dojo.tasks.all"
-#	],
-#	"daily": [
-#		"bjj_dojo.tasks.daily"
-#	],
-#	"hourly": [
-#		"bjj_dojo.tasks.hourly"
-#	],
-#	"weekly": [
-#		"bjj_dojo.tasks.weekly"
-#	]
-#	"monthly": [
-#		"bjj_dojo.tasks.monthly"
-#	]
-# }
+scheduler_events = {
+	"cron": {
+		# Drain kiosk check-ins a finishing counter job left in the pending sets
+		"*/5 * * * *": [
+			"bjj_dojo.bjj_dojo.api.kiosk.apply_kiosk_check_ins"
+		]
+	},
+	"daily": [
+		"bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.repair_last_attendance_dates",
+		"bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.repair_eligible_from_dates",
+		"bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.reconcile_member_ledgers",
+		"bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.refresh_payment_statuses",
+		"bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member.refresh_rolling_attendance_counts"
+	],
+	"monthly": [
+		"bjj_dojo.bjj_dojo.doctype.dojo_billing_run.dojo_billing_run.create_monthly_billing_run"
+	]
+}
 
 # Testing
 # -------
@@ -0,0 +1,16 @@
+import frappe
+
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import rebuild_daily_metrics
+
+
+def execute():
+	"""Approximate cancellation_date for inactive members and add cancellations to the rollup"""
+	# The last modification is the best record we have of when a member left
+	frappe.db.sql("""
+		UPDATE `tabDojo Member`
+		SET cancellation_date = GREATEST(join_date, DATE(modified))
+		WHERE status != 'Active'
+			AND cancellation_date IS NULL
+	""")
+	
+	rebuild_daily_metrics()
\ No newline at end of file
@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import rebuild_daily_metrics
+
+
+def execute():
+	"""Populate the daily metrics rollup from existing payments, members and attendance"""
+	rebuild_daily_metrics()
\ No newline at end of file
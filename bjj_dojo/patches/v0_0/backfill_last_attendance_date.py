@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import refresh_last_attendance_dates
+
+
+def execute():
+	"""Populate the newly declared last_attendance_date from attendance history"""
+	refresh_last_attendance_dates()
\ No newline at end of file
@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import reconcile_member_ledgers
+
+
+def execute():
+	"""Build each member's total_paid ledger from existing payments"""
+	reconcile_member_ledgers()
\ No newline at end of file
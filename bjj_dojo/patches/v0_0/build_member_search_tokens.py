@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_member_search_token.dojo_member_search_token import rebuild_search_tokens
+
+
+def execute():
+	"""Build typeahead search tokens for existing members"""
+	rebuild_search_tokens()
\ No newline at end of file
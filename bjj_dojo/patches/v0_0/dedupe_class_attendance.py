@@ -0,0 +1,37 @@
+import frappe
+
+
+# Where the removed marks' scope waits for refresh_deduped_attendance after the model sync
+DEDUPED_SCOPE_KEY = "bjj_dojo_deduped_class_attendance"
+
+
+def execute():
+	"""Remove duplicate (class, member) attendance marks so the unique index can be added"""
+	# Keep a Present mark over any other, then the most recently modified
+	duplicates = frappe.db.sql("""
+		SELECT name, class, member, class_date
+		FROM (
+			SELECT name, class, member, class_date,
+				ROW_NUMBER() OVER (
+					PARTITION BY class, member
+					ORDER BY status = 'Present' DESC, modified DESC, name DESC
+				) as position
+			FROM `tabClass Attendance`
+			WHERE class IS NOT NULL
+		) marks
+		WHERE position > 1
+	""", as_dict=True)
+	
+	if not duplicates:
+		return
+	
+	frappe.db.delete("Class Attendance", {"name": ["in", [row.name for row in duplicates]]})
+	
+	# Counters and rollups are only synced after the model sync, so refresh them from a post patch
+	frappe.db.set_global(DEDUPED_SCOPE_KEY, frappe.as_json({
+		"members": sorted({row.member for row in duplicates if row.member}),
+		"classes": sorted({row["class"] for row in duplicates}),
+		"dates": sorted({str(row.class_date) for row in duplicates if row.class_date})
+	}))
+	
+	print(f"Removed {len(duplicates)} duplicate Class Attendance marks")
\ No newline at end of file
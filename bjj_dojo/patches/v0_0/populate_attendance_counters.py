@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import rebuild_attendance_counters
+
+
+def execute():
+	"""Populate the member attendance counters from existing attendance"""
+	rebuild_attendance_counters()
\ No newline at end of file
@@ -0,0 +1,8 @@
+from frappe.utils import today
+
+from bjj_dojo.bjj_dojo.doctype.dojo_attendance_fact.dojo_attendance_fact import update_attendance_facts, get_earliest_fact_date
+
+
+def execute():
+	"""Populate the attendance fact rollup from existing attendance"""
+	update_attendance_facts(get_earliest_fact_date(), today())
\ No newline at end of file
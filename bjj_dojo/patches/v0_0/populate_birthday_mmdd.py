@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+	"""Derive birthday_mmdd for existing members from their date of birth"""
+	frappe.db.sql("""
+		UPDATE `tabDojo Member`
+		SET birthday_mmdd = CONCAT(LPAD(MONTH(date_of_birth), 2, '0'), '-', LPAD(DAY(date_of_birth), 2, '0'))
+		WHERE date_of_birth IS NOT NULL
+	""")
\ No newline at end of file
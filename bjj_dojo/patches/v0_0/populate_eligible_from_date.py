@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import repair_eligible_from_dates
+
+
+def execute():
+	"""Derive eligible_from_date for existing members from their belt and join dates"""
+	repair_eligible_from_dates()
\ No newline at end of file
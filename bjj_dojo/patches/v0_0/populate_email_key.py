@@ -0,0 +1,30 @@
+import frappe
+
+
+def execute():
+	"""Populate email_key for existing members and report emails shared by several members"""
+	collisions = frappe.db.sql("""
+		SELECT LOWER(TRIM(email)) as email_key, GROUP_CONCAT(name ORDER BY name) as members
+		FROM `tabDojo Member`
+		WHERE IFNULL(TRIM(email), '') != ''
+		GROUP BY LOWER(TRIM(email))
+		HAVING COUNT(*) > 1
+	""", as_dict=True)
+	
+	# Only the oldest member per email gets the key, so the unique index holds
+	frappe.db.sql("""
+		UPDATE `tabDojo Member` m
+		JOIN (
+			SELECT MIN(name) as name
+			FROM `tabDojo Member`
+			WHERE IFNULL(TRIM(email), '') != ''
+			GROUP BY LOWER(TRIM(email))
+		) keep ON keep.name = m.name
+		SET m.email_key = LOWER(TRIM(m.email))
+	""")
+	
+	if collisions:
+		report = "\n".join(f"{row.email_key}: {row.members}" for row in collisions)
+		print(f"{len(collisions)} emails are shared by several Dojo Members; "
+			f"merge or correct them before saving the newer records:\n{report}")
+		frappe.log_error(f"Duplicate Dojo Member emails:\n{report}")
\ No newline at end of file
@@ -0,0 +1,6 @@
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import rebuild_daily_metrics
+
+
+def execute():
+	"""Rebuild the rollup now that revenue keeps refunded payments and nets their refunds"""
+	rebuild_daily_metrics()
\ No newline at end of file
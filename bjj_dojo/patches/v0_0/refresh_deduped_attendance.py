@@ -0,0 +1,28 @@
+import frappe
+import frappe.defaults
+
+from bjj_dojo.patches.v0_0.dedupe_class_attendance import DEDUPED_SCOPE_KEY
+from bjj_dojo.bjj_dojo.doctype.dojo_daily_metrics.dojo_daily_metrics import update_daily_metrics
+from bjj_dojo.bjj_dojo.doctype.dojo_member.dojo_member import refresh_last_attendance_dates, rebuild_attendance_counters
+
+
+def execute():
+	"""Refresh the counters and rollups of the marks removed by dedupe_class_attendance"""
+	scope = frappe.db.get_global(DEDUPED_SCOPE_KEY)
+	if not scope:
+		return
+	
+	scope = frappe.parse_json(scope)
+	
+	if scope.members:
+		refresh_last_attendance_dates(scope.members)
+		rebuild_attendance_counters(scope.members)
+	
+	for class_name in scope.classes:
+		if frappe.db.exists("Dojo Class", class_name):
+			frappe.get_doc("Dojo Class", class_name).update_attendance_stats()
+	
+	for class_date in scope.dates:
+		update_daily_metrics(class_date, ("attendance",))
+	
+	frappe.defaults.clear_default(DEDUPED_SCOPE_KEY, parent="__global")
\ No newline at end of file